@@ -1,13 +1,14 @@
 from django.contrib import admin
 from recipes.models import (Favourite, Follow, Ingredient, IngredientRecipe,
-                            Recipe, RecipeFavourite, RecipeShoppingCart,
-                            ShoppingCart, Tag, TagRecipe)
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe)
 from users.models import User
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'first_name', 'last_name')
+    list_display = ('id', 'username', 'first_name', 'last_name',
+                    'recipes_count', 'followers_count')
     list_filter = ('email', 'username')
     empty_value_display = '-пусто-'
 
@@ -22,7 +23,7 @@ class TagInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'name', 'favorite_count')
+    list_display = ('id', 'author', 'name', 'favourites_count')
     list_filter = ('author', 'name', 'tags')
     empty_value_display = '-пусто-'
     inlines = [
@@ -31,9 +32,6 @@ class RecipeAdmin(admin.ModelAdmin):
     ]
     exclude = ('ingredients',)
 
-    def favorite_count(self, obj):
-        return RecipeFavourite.objects.filter(recipe=obj).count()
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -61,35 +59,19 @@ class FollowAdmin(admin.ModelAdmin):
     list_display = ('id', 'author', 'follower')
 
 
-class RecipesInCartInline(admin.TabularInline):
-    model = ShoppingCart.recipes.through
-
-
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user_id', 'user',)
-    inlines = [
-        RecipesInCartInline,
-    ]
-
+    list_display = ('id', 'user', 'recipe')
+    list_filter = ('user',)
 
-@admin.register(RecipeShoppingCart)
-class RecipeShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('recipe_id', 'shopping_cart_id')
 
-
-@admin.register(RecipeFavourite)
-class RecipeFavouriteAdmin(admin.ModelAdmin):
-    list_display = ('recipe_id', 'recipe', 'favourite_id', 'favourite')
-
-
-class RecipesInline(admin.TabularInline):
-    model = Favourite.recipes.through
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'amount')
+    list_filter = ('user',)
 
 
 @admin.register(Favourite)
 class FavouriteAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user_id', 'user', )
-    inlines = [
-        RecipesInline,
-    ]
+    list_display = ('id', 'user', 'recipe')
+    list_filter = ('user',)
@@ -0,0 +1,254 @@
+"""
+Асинхронные представления для частых GET-запросов.
+
+Отдают тот же json, что и синхронные viewset-ы. Асинхронный ORM Django
+выполняет запросы в одном общем потоке (sync_to_async с
+thread_sensitive=True), поэтому одновременные запросы выстраивались бы
+к нему в очередь. Здесь вся работа представления с БД собрана в одну
+синхронную функцию, которая выполняется в потоке из пула
+(run_in_thread), и под ASGI-сервером один процесс обслуживает столько
+одновременных запросов к БД, сколько потоков в пуле ASYNC_DB_THREADS.
+Подключаются в api/urls.py настройкой ASYNC_READ_VIEWS; остальные
+методы тех же адресов обрабатываются синхронными viewset-ами.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections
+from django.db.models import F, Value
+from django.http import Http404, HttpResponse
+from django_filters.utils import translate_validation
+from recipes import ingredient_index
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.exceptions import (APIException, AuthenticationFailed,
+                                       NotAuthenticated, NotFound)
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from users.models import User
+
+from .authentication import CachedTokenAuthentication
+from .caching import (cached_json_response, recipe_fragment_key,
+                      recipe_fragments)
+from .filters import RecipeFilter
+from .pagination import RecipeCursorPagination, SubscriptionCursorPagination
+from .serializers import (AUTHOR_FIELDS, IngridientGetSerializer,
+                          RecipeSerializer, RecipesLimitSerializer,
+                          SubscriptionsSerializer, TagGetSerializer,
+                          with_viewer_fields)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_DB_THREADS,
+                    thread_name_prefix='async-db'
+                )
+    return _executor
+
+
+async def run_in_thread(func, *args):
+    """
+    Выполняет синхронную функцию func в потоке из пула ASYNC_DB_THREADS.
+    У каждого потока свое соединение с БД; после вызова оно закрывается
+    по CONN_MAX_AGE, как после синхронного запроса.
+    """
+    def call():
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return await sync_to_async(call, thread_sensitive=False,
+                               executor=get_executor())()
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status,
+                        content_type='application/json')
+
+
+def authenticate_user(request):
+    """
+    Пользователь по заголовку Authorization: Token <key>, как у
+    CachedTokenAuthentication, или AnonymousUser, если заголовка нет.
+    """
+    result = CachedTokenAuthentication().authenticate(request)
+    return AnonymousUser() if result is None else result[0]
+
+
+def async_api_view(authenticate=True):
+    """
+    Декоратор async-представления: оборачивает запрос в Request DRF,
+    определяет пользователя по токену и превращает APIException и Http404
+    в json-ответы того же вида, что у DRF.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request = Request(request)
+            try:
+                if authenticate:
+                    request.user = await run_in_thread(authenticate_user,
+                                                       request)
+                return await view(request, *args, **kwargs)
+            except Http404:
+                exc = NotFound()
+            except APIException as error:
+                exc = error
+            detail = (exc.detail if isinstance(exc.detail, (list, dict))
+                      else {'detail': exc.detail})
+            response = json_response(detail, status=exc.status_code)
+            if isinstance(exc, (AuthenticationFailed, NotAuthenticated)):
+                response['WWW-Authenticate'] = 'Token'
+            return response
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def get_paginator(request, cursor_pagination_class):
+    if 'cursor' in request.query_params:
+        return cursor_pagination_class()
+    return PageNumberPagination()
+
+
+def paginated_data(request, queryset, paginator, serializer_class,
+                   prepare_page=None):
+    page = paginator.paginate_queryset(queryset, request)
+    if prepare_page is not None:
+        prepare_page(page)
+    serializer = serializer_class(page, many=True,
+                                  context={'request': request})
+    return paginator.get_paginated_response(serializer.data).data
+
+
+def get_recipe_list(request):
+    user = request.user
+    filterset = RecipeFilter(
+        request.query_params,
+        Recipe.objects.with_related(user).with_user_flags(user),
+        request=request
+    )
+    if not filterset.is_valid():
+        raise translate_validation(filterset.errors)
+    return paginated_data(
+        request, filterset.qs,
+        get_paginator(request, RecipeCursorPagination), RecipeSerializer
+    )
+
+
+@async_api_view()
+async def recipe_list(request):
+    """Список рецептов, как RecipeViewSet.list."""
+    return json_response(await run_in_thread(get_recipe_list, request))
+
+
+def get_recipe(request, pk):
+    viewer = Recipe.objects.filter(pk=pk).viewer_fields(
+        request.user, AUTHOR_FIELDS
+    ).first()
+    if viewer is None:
+        raise NotFound()
+
+    def build_fragment():
+        recipe = (Recipe.objects.with_related()
+                  .with_user_flags(None).filter(pk=pk).first())
+        if recipe is None:
+            raise NotFound()
+        serializer = RecipeSerializer(recipe, context={'request': request})
+        return dict(serializer.data)
+
+    fragment = recipe_fragments.get_or_build(
+        recipe_fragment_key(request, pk), build_fragment
+    )
+    return with_viewer_fields(fragment, viewer)
+
+
+@async_api_view()
+async def recipe_detail(request, pk):
+    """Рецепт, как RecipeViewSet.retrieve, с тем же кэшем фрагментов."""
+    return json_response(await run_in_thread(get_recipe, request, pk))
+
+
+def get_subscriptions(request):
+    user = request.user
+    params = RecipesLimitSerializer(data=request.query_params)
+    params.is_valid(raise_exception=True)
+    authors = User.objects.filter(following__follower=user).annotate(
+        is_subscribed=Value(True), follow_id=F('following__id')
+    )
+
+    def attach_recipes(page):
+        recipes = Recipe.objects.latest_per_author(
+            [author.id for author in page],
+            params.validated_data['recipes_limit']
+        )
+        for author in page:
+            author.limited_recipes = recipes[author.id]
+
+    return paginated_data(
+        request, authors,
+        get_paginator(request, SubscriptionCursorPagination),
+        SubscriptionsSerializer, attach_recipes
+    )
+
+
+@async_api_view()
+async def subscriptions(request):
+    """Подписки пользователя, как UserViewSet.subscriptions."""
+    if request.user.is_anonymous:
+        raise NotAuthenticated()
+    return json_response(await run_in_thread(get_subscriptions, request))
+
+
+@async_api_view(authenticate=False)
+async def ingredient_list(request):
+    """Список и поиск ингредиентов, как IngredientViewSet.list."""
+    name = request.query_params.get('name')
+    if name is None:
+        def get_data():
+            return IngridientGetSerializer(Ingredient.objects.all(),
+                                           many=True).data
+        return await run_in_thread(cached_json_response, request,
+                                   'ingredients', get_data)
+    limit = request.query_params.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            return json_response(
+                {'limit': 'Укажите целое положительное число.'},
+                status=400
+            )
+        limit = int(limit)
+    index = await run_in_thread(ingredient_index.get_index)
+    return json_response(index.search(name, limit))
+
+
+@async_api_view(authenticate=False)
+async def tag_list(request):
+    """Список тегов, как TagViewSet.list."""
+    def get_data():
+        return TagGetSerializer(Tag.objects.all(), many=True).data
+    return await run_in_thread(cached_json_response, request, 'tags',
+                               get_data)
+
+
+@async_api_view(authenticate=False)
+async def tag_detail(request, pk):
+    """Тег, как TagViewSet.retrieve."""
+    def get_data():
+        try:
+            return TagGetSerializer(Tag.objects.get(pk=pk)).data
+        except (Tag.DoesNotExist, ValueError):
+            raise NotFound()
+    return await run_in_thread(cached_json_response, request, 'tags',
+                               get_data)
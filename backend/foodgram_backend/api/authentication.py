@@ -0,0 +1,144 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+
+class TokenCache:
+    """
+    LRU-кэш token key -> (user_id, is_active) с ограниченным временем
+    жизни записей, свой в каждом процессе.
+    С shared=True (по умолчанию при общем кэше, SHARED_CACHE) записи
+    хранятся только в кэше Django. Удаление записи оставляет на timeout
+    отметку REVOKED, а set не перезаписывает существующий ключ, поэтому
+    пользователь, прочитанный из БД до удаления, в кэш не попадает.
+    """
+    key_prefix = 'auth-token:'
+    REVOKED = 'revoked'
+
+    def __init__(self, timeout, max_size, shared=False):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = 0
+        self.generation = 0
+
+    def shared_key(self, key):
+        # В общий кэш не попадает сам токен.
+        return self.key_prefix + hashlib.sha256(key.encode()).hexdigest()
+
+    @staticmethod
+    def user(user_id, is_active):
+        # Остальные поля загружаются из БД при первом обращении к ним.
+        return User.from_db(None, ['id', 'is_active'], [user_id, is_active])
+
+    def get(self, key):
+        """Возвращает пользователя токена или None."""
+        if self.shared:
+            return self._get_shared(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user_id, is_active, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self.user(user_id, is_active)
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def _get_shared(self, key):
+        entry = cache.get(self.shared_key(key))
+        valid = entry is not None and entry != self.REVOKED
+        with self._lock:
+            if not valid:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        return self.user(*entry)
+
+    def set(self, key, user, generation):
+        """
+        Сохраняет пользователя, прочитанного из БД при указанном
+        generation; если с тех пор были удаления, запись не сохраняется.
+        """
+        if self.shared:
+            cache.add(self.shared_key(key), (user.id, user.is_active),
+                      self.timeout)
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (user.id, user.is_active,
+                                  time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        if self.shared:
+            cache.set_many({self.shared_key(key): self.REVOKED
+                            for key in keys}, self.timeout)
+            return
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        """Удаляет записи всех токенов пользователя."""
+        self.invalidate(*Token.objects.filter(
+            user_id=user_id
+        ).values_list('key', flat=True))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        """Счетчики обращений к кэшу этого процесса."""
+        with self._lock:
+            hits = self.hits + self.shared_hits
+            lookups = hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+
+token_cache = TokenCache(
+    timeout=settings.TOKEN_CACHE_TIMEOUT,
+    max_size=settings.TOKEN_CACHE_MAX_SIZE,
+    shared=settings.TOKEN_CACHE_SHARED,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса Token + User к БД для токенов,
+    найденных в token_cache. В кэш попадают только действующие токены
+    активных пользователей.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            generation = token_cache.generation
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, generation)
+            return user, token
+        return user, Token(key=key, user=user)
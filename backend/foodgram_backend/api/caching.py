@@ -0,0 +1,143 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from recipes.cache_versions import get_version, get_versions
+from rest_framework.renderers import JSONRenderer
+
+BODY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def body_cache_key(namespace, version, request):
+    return f'response:{namespace}:{version}:{request.get_full_path()}'
+
+
+class FragmentCache:
+    """
+    Общие для всех пользователей части ответов в кэше Django.
+    Ключ фрагмента включает версии данных, из которых он построен,
+    поэтому устаревший фрагмент больше не читается, а вытесняется
+    по времени. Без общего кэша (SHARED_CACHE) фрагменты строятся
+    на каждый запрос. Считает попадания и промахи этого процесса.
+    """
+
+    def __init__(self, timeout=BODY_CACHE_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_or_build(self, key, build):
+        if not settings.SHARED_CACHE:
+            return build()
+        fragment = cache.get(key)
+        self.count(fragment is not None)
+        if fragment is None:
+            fragment = build()
+            cache.set(key, fragment, self.timeout)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Счетчики обращений к кэшу этого процесса."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+recipe_fragments = FragmentCache()
+
+
+def recipe_fragment_key(request, pk):
+    """
+    Ключ рецепта без полей пользователя: версия рецепта увеличивается
+    при сохранении и удалении рецепта и его связей, версии tags и
+    ingredients - при изменении тегов и ингредиентов. Ссылки на
+    картинки абсолютные, поэтому ключ включает адрес сайта.
+    """
+    versions = get_versions(f'recipe:{pk}', 'tags', 'ingredients')
+    return (f'fragment:recipe:{pk}:{request.build_absolute_uri("/")}:'
+            + ':'.join(map(str, versions)))
+
+
+def with_validators(response, etag, modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    return response
+
+
+def cached_json_response(request, namespace, get_data):
+    """
+    Вариант VersionedCacheMixin.cached_response для async-представлений:
+    get_data возвращает данные ответа.
+    """
+    if not settings.SHARED_CACHE:
+        return HttpResponse(JSONRenderer().render(get_data()),
+                            content_type='application/json')
+    version, modified = get_version(namespace)
+    etag = f'"{namespace}-{version}"'
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=modified)
+    if response is None:
+        key = body_cache_key(namespace, version, request)
+        body = cache.get(key)
+        if body is None:
+            body = JSONRenderer().render(get_data())
+            cache.set(key, body, BODY_CACHE_TIMEOUT)
+        response = HttpResponse(body, content_type='application/json')
+    return with_validators(response, etag, modified)
+
+
+class VersionedCacheMixin:
+    """
+    Кэширование готовых json-ответов list и retrieve.
+    Ключ кэша включает версию cache_namespace, которая увеличивается
+    при каждом изменении данных. Ответы содержат ETag и Last-Modified,
+    на If-None-Match с актуальной версией возвращается 304
+    без обращения к БД. Без общего кэша (SHARED_CACHE) версии
+    других процессов неизвестны, и ответы не кэшируются.
+    """
+    cache_namespace = None
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        if (not settings.SHARED_CACHE
+                or request.accepted_renderer.format != 'json'):
+            return handler(request, *args, **kwargs)
+        version, modified = get_version(self.cache_namespace)
+        etag = f'"{self.cache_namespace}-{version}"'
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=modified)
+        if response is None:
+            key = body_cache_key(self.cache_namespace, version, request)
+            body = cache.get(key)
+            if body is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                body = JSONRenderer().render(response.data)
+                cache.set(key, body, BODY_CACHE_TIMEOUT)
+            response = HttpResponse(body, content_type='application/json')
+        return with_validators(response, etag, modified)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve,
+                                    *args, **kwargs)
@@ -1,6 +1,10 @@
 import django_filters
+from django import forms
+from django_filters.fields import BaseCSVField
 from recipes.models import Ingredient, Recipe, Tag
 
+HAVE_MAX_VALUES = 50
+
 
 class IngredientFilter(django_filters.FilterSet):
     """Филтрация ингредиента по полю name."""
@@ -11,17 +15,41 @@ class IngredientFilter(django_filters.FilterSet):
         fields = ['name']
 
     def filter_name(self, queryset, name, value):
-        return Ingredient.objects.filter(name__icontains=value)
+        return queryset.filter(name__icontains=value)
 
     @classmethod
     def get_search_fields(cls, request):
         return ['name']
 
 
+class LimitedCSVField(BaseCSVField):
+    """Список значений через запятую не длиннее max_values."""
+
+    def __init__(self, *args, max_values=None, **kwargs):
+        self.max_values = max_values
+        super().__init__(*args, **kwargs)
+
+    def clean(self, value):
+        if (value is not None and self.max_values is not None
+                and len(value) > self.max_values):
+            raise forms.ValidationError(
+                f'Укажите не больше {self.max_values} значений.',
+                code='max_values'
+            )
+        return super().clean(value)
+
+
+class IntegerInFilter(django_filters.BaseInFilter):
+    """Список целых чисел через запятую, max_values ограничивает длину."""
+    base_field_class = LimitedCSVField
+    field_class = forms.IntegerField
+
+
 class RecipeFilter(django_filters.FilterSet):
     """
-    Фильтрация рецептов по тегам, автору, избранному и рецептам,
-    добавленным в корзину.
+    Фильтрация рецептов по тегам, автору, избранному, рецептам,
+    добавленным в корзину, полнотекстовый поиск по названию и описанию
+    и подбор рецептов по имеющимся ингредиентам.
     """
     tags = django_filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
@@ -33,10 +61,13 @@ class RecipeFilter(django_filters.FilterSet):
     is_in_shopping_cart = django_filters.CharFilter(
         method='get_is_in_shopping_cart'
     )
+    search = django_filters.CharFilter(method='get_search')
+    have = IntegerInFilter(method='get_have', max_values=HAVE_MAX_VALUES)
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'have']
 
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -49,3 +80,18 @@ class RecipeFilter(django_filters.FilterSet):
         if value:
             return queryset.filter(shoppingcart__user=user)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        """
+        Рецепты, подходящие под запрос, по убыванию релевантности.
+        Курсор пагинации строится по этому же порядку.
+        """
+        return queryset.search(value)
+
+    def get_have(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из ингредиентов value: сначала те,
+        что можно приготовить целиком, затем по числу недостающих.
+        Курсор пагинации строится по этому же порядку.
+        """
+        return queryset.by_coverage(value)
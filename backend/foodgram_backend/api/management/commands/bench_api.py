@@ -0,0 +1,103 @@
+import json
+import statistics
+import time
+
+from api.metrics import percentile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from recipes.models import Ingredient, Recipe
+from recipes.synthetic import Seeder
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+ROUTES = (
+    '/api/recipes/',
+    '/api/recipes/{recipe}/',
+    '/api/users/subscriptions/',
+    '/api/recipes/feed/',
+    '/api/recipes/download_shopping_cart/',
+    '/api/ingredients/?name={ingredient}',
+)
+
+
+class Command(BaseCommand):
+    """Latency and query counts of the main API routes."""
+    help = ('Seed a synthetic dataset, request every main API route '
+            'through the test client and print latency percentiles and '
+            'query counts as JSON. The dataset is rolled back unless '
+            '--keep is given.')
+
+    def add_arguments(self, parser):
+        for name, default, help_text in (
+            ('users', 50, 'Synthetic users.'),
+            ('recipes', 500, 'Synthetic recipes.'),
+            ('follows', 10, 'Authors followed by a user on average.'),
+            ('favourites', 20, 'Favourite recipes of a user on average.'),
+            ('carts', 5, 'Recipes in the shopping cart of every user.'),
+            ('iterations', 50, 'Measured requests per route.'),
+            ('warmup', 3, 'Unmeasured requests per route before that.'),
+            ('seed', 0, 'Random seed of the dataset.'),
+        ):
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=help_text)
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Commit the synthetic dataset instead of rolling it back.'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('At least 2 users and 1 recipe are needed.')
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive.')
+        with transaction.atomic():
+            seeder = Seeder(
+                options['users'], options['recipes'], options['follows'],
+                options['favourites'], options['carts'], options['seed']
+            )
+            dataset = {model.__name__: rows
+                       for model, rows in seeder.run().items()}
+            user = User.objects.get(pk=seeder.first_user)
+            token = Token.objects.create(user=user)
+            client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+            ingredient = Ingredient.objects.order_by('id').first()
+            recipe = Recipe.objects.order_by('-id').first()
+            results = {}
+            for route in ROUTES:
+                path = route.format(recipe=recipe.id,
+                                    ingredient=ingredient.name[:3])
+                results[route] = self.measure(client, path, options)
+            if not options['keep']:
+                transaction.set_rollback(True)
+        self.stdout.write(json.dumps({
+            'database': connection.vendor,
+            'dataset': dataset,
+            'iterations': options['iterations'],
+            'routes': results,
+        }, indent=2, ensure_ascii=False))
+
+    def measure(self, client, path, options):
+        for _ in range(options['warmup']):
+            client.get(path).getvalue()
+        timings, queries, statuses = [], [], []
+        for _ in range(options['iterations']):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(path)
+                # Streaming responses run their queries while read.
+                response.getvalue()
+                timings.append(time.perf_counter() - start)
+            queries.append(len(context.captured_queries))
+            statuses.append(response.status_code)
+        return {
+            **{f'p{share}_ms':
+               round(percentile(timings, share / 100) * 1000, 2)
+               for share in (50, 95, 99)},
+            'queries': statistics.median(queries),
+            'queries_max': max(queries),
+            'statuses': {str(status): statuses.count(status)
+                         for status in sorted(set(statuses))},
+        }
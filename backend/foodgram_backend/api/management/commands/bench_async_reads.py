@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from api.metrics import percentile
+from api.urls import async_urlpatterns
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.http import QueryDict
+from django.test import AsyncRequestFactory, RequestFactory
+from recipes.models import Ingredient, Recipe
+from rest_framework.authtoken.models import Token
+from users.models import User
+
+ROUTES = (
+    'recipes/',
+    'recipes/{recipe}/',
+    'users/subscriptions/',
+    'ingredients/?name={ingredient}',
+    'tags/',
+)
+
+
+def report(timings, statuses, elapsed):
+    return {
+        'rps': round(len(timings) / elapsed, 1),
+        **{f'p{share}_ms': round(percentile(timings, share / 100) * 1000, 2)
+           for share in (50, 95, 99)},
+        'statuses': {str(status): statuses.count(status)
+                     for status in sorted(set(statuses))},
+    }
+
+
+class Command(BaseCommand):
+    """Sync against async read views under concurrent load."""
+    help = ('Run the hot GET endpoints through their sync viewsets and '
+            'their async views with the same concurrency and print the '
+            'throughput and latency percentiles as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Requests per route and mode.'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help=('Requests in flight: worker threads for the sync views, '
+                  'pending coroutines for the async ones.')
+        )
+        parser.add_argument(
+            '--db-latency',
+            type=float,
+            default=0,
+            help='Milliseconds added to every query, to imitate a remote DB.'
+        )
+        parser.add_argument(
+            '--user',
+            help='Username to authenticate as; the first user by default.'
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be '
+                               'positive.')
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'])
+        user = users.first()
+        recipe = Recipe.objects.order_by('id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        if user is None or recipe is None or ingredient is None:
+            raise CommandError('Users, recipes and ingredients are needed; '
+                               'load some data first.')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.authorization = f'Token {token.key}'
+        self.latency = options['db_latency'] / 1000
+        results = {}
+        for route in ROUTES:
+            route = route.format(recipe=recipe.id,
+                                 ingredient=ingredient.name[:3])
+            path, _, query = route.partition('?')
+            views, kwargs = self.resolve(path)
+            target = (f'/api/{path}', QueryDict(query).dict())
+            results[f'/api/{route}'] = {
+                'sync': self.run_sync(views.sync_view, target, kwargs,
+                                      options),
+                'async': async_to_sync(self.run_async)(
+                    views.async_view, target, kwargs, options
+                ),
+            }
+        self.stdout.write(json.dumps(results, indent=2, ensure_ascii=False))
+
+    def resolve(self, path):
+        for pattern in async_urlpatterns:
+            match = pattern.resolve(path)
+            if match:
+                return match.func, match.kwargs
+        raise CommandError(f'No async view for {path}.')
+
+    def delay(self, execute, sql, params, many, context):
+        time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+    def add_delay(self, sender, connection, **kwargs):
+        if self.delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.delay)
+
+    @contextmanager
+    def with_latency(self):
+        # Both modes query the database from pool threads, every one
+        # with its own connection, so the delay is added to the
+        # connections opened during the run.
+        if not self.latency:
+            yield
+            return
+        connection_created.connect(self.add_delay)
+        try:
+            yield
+        finally:
+            connection_created.disconnect(self.add_delay)
+
+    def run_sync(self, view, target, kwargs, options):
+        factory = RequestFactory()
+
+        def call(_):
+            request = factory.get(*target,
+                                  HTTP_AUTHORIZATION=self.authorization)
+            start = time.perf_counter()
+            response = view(request, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return time.perf_counter() - start, response.status_code
+
+        with self.with_latency():
+            start = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                calls = list(executor.map(call, range(options['requests'])))
+            elapsed = time.perf_counter() - start
+        timings, statuses = zip(*calls)
+        return report(timings, statuses, elapsed)
+
+    async def run_async(self, view, target, kwargs, options):
+        factory = AsyncRequestFactory()
+        slots = asyncio.Semaphore(options['concurrency'])
+
+        async def call():
+            async with slots:
+                request = factory.get(*target,
+                                      authorization=self.authorization)
+                start = time.perf_counter()
+                response = await view(request, **kwargs)
+                return time.perf_counter() - start, response.status_code
+
+        with self.with_latency():
+            start = time.perf_counter()
+            calls = await asyncio.gather(
+                *(call() for _ in range(options['requests']))
+            )
+            elapsed = time.perf_counter() - start
+        timings, statuses = zip(*calls)
+        return report(timings, statuses, elapsed)
@@ -0,0 +1,242 @@
+"""
+Метрики производительности запросов.
+
+RequestMetricsMiddleware замеряет каждый запрос: общее время, число и
+время SQL-запросов и время сериализации. Замеры отдаются в заголовке
+Server-Timing и накапливаются в гистограммах по маршрутам (viewset и
+action), которые /api/_metrics/ выводит в текстовом формате Prometheus.
+Гистограммы свои в каждом процессе.
+"""
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .authentication import token_cache
+from .caching import recipe_fragments
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_timings = ContextVar('request_timings', default=None)
+
+
+def percentile(values, share):
+    """Процентиль по методу ближайшего ранга, share от 0 до 1."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+class RequestTimings:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self._depth = 0
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self, total):
+        return ', '.join((
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'serializer;dur={self.serializer * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL на всех соединениях: засчитывает запрос
+    в замеры текущего запроса, если они собираются. Контекст переносится
+    в потоки sync_to_async, поэтому учитываются и запросы к БД из
+    async-представлений.
+    """
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection):
+    """Подключает record_query к соединению, один раз."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def collect():
+    """Собирает замеры запроса, выполняемого внутри блока."""
+    timings = RequestTimings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def track_serializer():
+    # Вложенные сериализаторы выполняются внутри внешнего,
+    # поэтому засчитывается только время самого внешнего.
+    timings = _timings.get()
+    if timings is None or timings._depth:
+        yield
+        return
+    timings._depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer += time.perf_counter() - start
+        timings._depth -= 1
+
+
+class TimedSerializerMixin:
+    """Засчитывает время to_representation в метрики запроса."""
+
+    def to_representation(self, instance):
+        with track_serializer():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, как в Prometheus."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield f'{name}_bucket{{{labels},le="{bound}"}}', count
+        yield f'{name}_bucket{{{labels},le="+Inf"}}', self.count
+        yield f'{name}_sum{{{labels}}}', self.sum
+        yield f'{name}_count{{{labels}}}', self.count
+
+
+class RouteMetrics:
+    """Замеры одного маршрута."""
+
+    def __init__(self, window):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.db = Histogram(DURATION_BUCKETS)
+        self.serializer = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.statuses = defaultdict(int)
+        # Последние замеры общего времени для процентилей.
+        self.recent = deque(maxlen=window)
+
+    def observe(self, timings, total, status):
+        self.duration.observe(total)
+        self.db.observe(timings.db)
+        self.serializer.observe(timings.serializer)
+        self.queries.observe(timings.queries)
+        self.statuses[status] += 1
+        self.recent.append(total)
+
+    def quantiles(self):
+        for quantile in QUANTILES:
+            yield quantile, percentile(self.recent, quantile)
+
+
+class MetricsRegistry:
+    """Метрики процесса по маршрутам."""
+
+    def __init__(self, window):
+        self.window = window
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, timings, total, status):
+        with self._lock:
+            metrics = self._routes.get(route)
+            if metrics is None:
+                metrics = self._routes[route] = RouteMetrics(self.window)
+            metrics.observe(timings, total, status)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = []
+            self._render_summary(lines, routes)
+            for name, attr, help_text in (
+                ('foodgram_request_duration_seconds', 'duration',
+                 'Request processing time.'),
+                ('foodgram_request_db_seconds', 'db',
+                 'Time spent in SQL queries.'),
+                ('foodgram_request_serializer_seconds', 'serializer',
+                 'Time spent in serializers.'),
+                ('foodgram_request_queries', 'queries',
+                 'SQL queries per request.'),
+            ):
+                lines += [f'# HELP {name} {help_text}',
+                          f'# TYPE {name} histogram']
+                for route, metrics in routes:
+                    lines += (
+                        f'{sample} {value}' for sample, value in
+                        getattr(metrics, attr).samples(name,
+                                                       f'route="{route}"')
+                    )
+            lines += ['# HELP foodgram_requests_total Requests by status.',
+                      '# TYPE foodgram_requests_total counter']
+            for route, metrics in routes:
+                lines += (
+                    f'foodgram_requests_total{{route="{route}",'
+                    f'status="{status}"}} {count}'
+                    for status, count in sorted(metrics.statuses.items())
+                )
+        for prefix, stats in (
+            ('foodgram_token_cache', token_cache.stats()),
+            ('foodgram_recipe_fragment_cache', recipe_fragments.stats()),
+        ):
+            for key, value in stats.items():
+                name = f'{prefix}_{key}'
+                lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def _render_summary(self, lines, routes):
+        name = 'foodgram_request_latency_seconds'
+        lines += [
+            f'# HELP {name} Request time percentiles over the last '
+            f'{self.window} requests of the route.',
+            f'# TYPE {name} summary',
+        ]
+        for route, metrics in routes:
+            lines += (
+                f'{name}{{route="{route}",quantile="{quantile}"}} {value}'
+                for quantile, value in metrics.quantiles()
+            )
+            lines += [
+                f'{name}_sum{{route="{route}"}} {metrics.duration.sum}',
+                f'{name}_count{{route="{route}"}} {metrics.duration.count}',
+            ]
+
+
+registry = MetricsRegistry(window=settings.REQUEST_METRICS_WINDOW)
@@ -0,0 +1,67 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import collect, registry
+
+
+def route_name(request, view_func):
+    """
+    Имя маршрута для метрик: viewset и action или имя представления.
+    Путь запроса не используется, чтобы число маршрутов было конечным.
+    """
+    # Адреса read_async из api/urls.py: GET обрабатывает async_view.
+    if hasattr(view_func, 'async_view'):
+        view_func = (view_func.async_view if request.method == 'GET'
+                     else view_func.sync_view)
+    view_class = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None)
+    if view_class is not None and actions:
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{view_class.__name__}.{action}'
+    if view_class is not None:
+        return view_class.__name__
+    return f'{view_func.__module__}.{view_func.__name__}'
+
+
+class RequestMetricsMiddleware:
+    """
+    Замеряет время запроса, SQL-запросы и сериализацию, отдает их
+    в заголовке Server-Timing и накапливает в api.metrics.registry.
+    Работает и в синхронной, и в асинхронной цепочке обработчиков,
+    чтобы под ASGI async-представления не выполнялись в потоке.
+    SQL-запросы засчитывает api.metrics.record_query.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with collect() as timings:
+            response = self.get_response(request)
+        return self.observe(request, response, timings, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with collect() as timings:
+            response = await self.get_response(request)
+        return self.observe(request, response, timings, start)
+
+    def observe(self, request, response, timings, start):
+        total = time.perf_counter() - start
+        response['Server-Timing'] = timings.server_timing(total)
+        # Маршрут определяется после ответа, а не в process_view: такой
+        # метод Django вызывал бы в async-цепочке через поток.
+        match = getattr(request, 'resolver_match', None)
+        route = (route_name(request, match.func) if match is not None
+                 else 'unmatched')
+        registry.observe(route, timings, total, response.status_code)
+        return response
@@ -1,6 +1,188 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import datetime
+import json
+
+from django.db.models import Q
+from recipes import timeline
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 
 class SubscriptionPagination(PageNumberPagination):
     """Пагинация для стриницы подписок."""
     pass
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу сортировки (keyset).
+    Следующая страница выбирается условием на значения полей ordering
+    последней записи, а не смещением, поэтому стоимость запроса не
+    зависит от глубины прокрутки, а новые записи не сдвигают страницы.
+    Последнее поле ordering должно быть уникальным. Если queryset
+    упорядочен явно и последнее поле его порядка - id (релевантность
+    поиска, подбор по ингредиентам), курсор строится по этому порядку.
+    """
+    page_size = api_settings.PAGE_SIZE
+    ordering = None
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    def get_ordering(self, queryset):
+        ordering = queryset.query.order_by
+        if (ordering and all(isinstance(name, str) for name in ordering)
+                and ordering[-1].lstrip('-') in ('id', 'pk')):
+            return tuple(ordering)
+        return self.ordering
+
+    def page_queryset(self, queryset, request):
+        """Запрос page_size + 1 записей, следующих за курсором."""
+        self.request = request
+        self.current_ordering = self.get_ordering(queryset)
+        values, self.reverse = self.decode_cursor(request)
+        self.after_cursor = values is not None
+        fields = [(name.lstrip('-'), name.startswith('-'))
+                  for name in self.current_ordering]
+        if values is not None:
+            queryset = queryset.filter(
+                self.after_condition(fields, values, self.reverse)
+            )
+        queryset = queryset.order_by(*(
+            f'-{name}' if descending != self.reverse else name
+            for name, descending in fields
+        ))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.after_cursor
+        self.page = rows
+        return rows
+
+    @staticmethod
+    def after_condition(fields, values, reverse):
+        """Условие "строка идет после курсора" в порядке сортировки."""
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(fields, values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor['v'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(values, list)
+                or len(values) != len(self.current_ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    @staticmethod
+    def encode_value(value):
+        # Время сохраняется полностью, с микросекундами.
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        raise TypeError(f'{type(value).__name__} не поддерживается.')
+
+    def encode_cursor(self, instance, reverse):
+        values = [getattr(instance, name.lstrip('-'))
+                  for name in self.current_ordering]
+        cursor = json.dumps({'v': values, 'r': int(reverse)},
+                            default=self.encode_value)
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            base64.urlsafe_b64encode(cursor.encode()).decode()
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class RecipeCursorPagination(KeysetPagination):
+    """Keyset-пагинация ленты рецептов: сначала новые."""
+    ordering = ('-publication_date', '-id')
+
+
+class FeedPagination(RecipeCursorPagination):
+    """
+    Keyset-пагинация ленты подписок. Страница собирается из таймлайна
+    пользователя и рецептов популярных авторов (recipes.timeline.feed),
+    а не из соединения подписок с рецептами.
+    """
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.current_ordering = self.ordering
+        values, self.reverse = self.decode_cursor(request)
+        self.after_cursor = values is not None
+        ids = timeline.feed(request.user, self.page_size + 1, values,
+                            self.reverse)
+        recipes = queryset.in_bulk(ids)
+        return [recipes[pk] for pk in ids if pk in recipes]
+
+
+class SubscriptionCursorPagination(KeysetPagination):
+    """Keyset-пагинация подписок: сначала последние подписки."""
+    ordering = ('-follow_id',)
+
+
+class CursorOptInMixin:
+    """
+    Включает cursor_pagination_class вместо обычной пагинации,
+    если в запросе передан параметр cursor (для первой страницы - пустой).
+    """
+    cursor_pagination_class = None
+
+    def use_cursor_pagination(self):
+        return (self.cursor_pagination_class is not None
+                and 'cursor' in self.request.query_params)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_cursor_pagination():
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
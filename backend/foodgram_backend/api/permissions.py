@@ -11,7 +11,6 @@ class AuthorOrReadOnly(permissions.BasePermission):
     """
 
     def has_permission(self, request, view):
-        print(view)
         return (request.method in permissions.SAFE_METHODS
                 or request.user.is_authenticated)
 
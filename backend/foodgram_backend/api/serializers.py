@@ -1,26 +1,131 @@
 import base64
+import binascii
+from tempfile import SpooledTemporaryFile
 
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
-from django.core.files.base import ContentFile
+from django.core.files.base import File
+from django.db import connection, transaction
+from PIL import Image
+from recipes import image_variants, timeline
+from recipes.counters import increment_many
 from recipes.models import (Favourite, Follow, Ingredient, IngredientRecipe,
-                            Recipe, ShoppingCart, Tag, TagRecipe)
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe)
 from rest_framework import serializers
 from rest_framework.relations import SlugRelatedField
 from users.models import User
 
+from .metrics import TimedSerializerMixin
+
 
 class Base64ImageField(serializers.ImageField):
-    """Сериализатор для декодирования картинок"""
-    def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+    """
+    Сериализатор для декодирования картинок из data URI.
+    Base64 декодируется частями во временный файл, который остается
+    в памяти только до SPOOL_MAX_SIZE байт. Картинки больше max_size
+    байт (по умолчанию RECIPE_IMAGE_MAX_SIZE) отклоняются по длине
+    строки, до декодирования. Переносы строк и пробелы в base64
+    допускаются и отбрасываются в каждой части, без копии всей строки.
+    """
+    DECODE_CHUNK_SIZE = 64 * 1024
+    WHITESPACE = ' \t\n\r\x0b\x0c'
+    SPOOL_MAX_SIZE = 1024 * 1024
+    default_error_messages = {
+        'invalid_base64': 'Некорректная base64-строка картинки.',
+        'too_large': 'Размер картинки не должен превышать {max_size} байт.',
+    }
+
+    def __init__(self, max_size=None, **kwargs):
+        self.max_size = max_size
+        super().__init__(**kwargs)
 
-        return super().to_internal_value(data)
+    def to_internal_value(self, data):
+        if not (isinstance(data, str) and data.startswith('data:image')):
+            return super().to_internal_value(data)
+        marker = data.find(';base64,')
+        if marker == -1:
+            self.fail('invalid_base64')
+        start = marker + len(';base64,')
+        max_size = self.max_size or settings.RECIPE_IMAGE_MAX_SIZE
+        # Без учета '=' в конце: точный размер проверяет decode.
+        whitespace = sum(data.count(char, start) for char in self.WHITESPACE)
+        if (len(data) - start - whitespace) // 4 * 3 - 2 > max_size:
+            self.fail('too_large', max_size=max_size)
+
+        file = SpooledTemporaryFile(max_size=self.SPOOL_MAX_SIZE)
+        try:
+            image_format = self.decode(data, start, file, max_size)
+        except Exception:
+            file.close()
+            raise
+        # Pillow уже проверил файл, а ImageField прочитал бы его
+        # в память целиком, поэтому проверки ImageField пропускаются.
+        return super(serializers.ImageField, self).to_internal_value(
+            File(file, name=f'temp.{image_format.lower()}')
+        )
+
+    def decode(self, data, start, file, max_size):
+        """
+        Пишет картинку из data[start:] в file и возвращает ее формат
+        по данным Pillow.
+        """
+        # Из каждой части отбрасываются пробелы, остаток до кратной 4
+        # длины переносится в следующую часть.
+        rest = ''
+        try:
+            for offset in range(start, len(data), self.DECODE_CHUNK_SIZE):
+                chunk = rest + ''.join(
+                    data[offset:offset + self.DECODE_CHUNK_SIZE].split()
+                )
+                end = len(chunk) - len(chunk) % 4
+                file.write(base64.b64decode(chunk[:end], validate=True))
+                rest = chunk[end:]
+            file.write(base64.b64decode(rest, validate=True))
+        except (binascii.Error, ValueError):
+            self.fail('invalid_base64')
+        if file.tell() > max_size:
+            self.fail('too_large', max_size=max_size)
+        file.seek(0)
+        try:
+            with Image.open(file) as image:
+                image_format = image.format
+                image.verify()
+        except Exception:
+            self.fail('invalid_image')
+        file.seek(0)
+        return image_format
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии картинки рецепта:
+    {'list': {'jpeg': url, 'webp': url}, 'detail': {...}}.
+    Пока копии не готовы - пустой словарь, клиент использует image.
+    """
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not image_variants.is_current(recipe):
+            return {}
+        storage = recipe.image.storage
+        request = self.context.get('request')
+        return {
+            variant: {
+                extension: (
+                    request.build_absolute_uri(storage.url(name))
+                    if request is not None else storage.url(name)
+                )
+                for extension, name in files.items()
+            }
+            for variant, files in recipe.image_variants['files'].items()
+        }
 
 
-class IngridientGetSerializer(serializers.ModelSerializer):
+class IngridientGetSerializer(TimedSerializerMixin,
+                              serializers.ModelSerializer):
     """Сериализатор для гет запросов по ингредиентам."""
     measurement_unit = serializers.CharField(source='units')
 
@@ -34,10 +139,7 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
     Вспомогательный сериализатор для создания рецептов.
     В Post-запросе передается пара ingredient/amount.
     """
-    id = serializers.PrimaryKeyRelatedField(
-        source='ingredient.id',
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField(source='ingredient.id')
     name = serializers.CharField(
         source='ingredient.name',
         read_only=True
@@ -53,7 +155,7 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount',)
 
 
-class TagGetSerializer(serializers.ModelSerializer):
+class TagGetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для получения списка тегов или информации
     по конкретному тегу.
@@ -66,21 +168,25 @@ class TagGetSerializer(serializers.ModelSerializer):
         read_only_fields = ('name', 'color', 'slug',)
 
 
-class RecipesGetSerializer(serializers.ModelSerializer):
+class RecipesGetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Вспомогательный сериализатор рецептов."""
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для создания пользователя,
     просмотра списка или отдельного пользователя
     """
     is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipesGetSerializer(many=True, read_only=True)
+    recipes = RecipesGetSerializer(source='limited_recipes',
+                                   many=True,
+                                   read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -91,10 +197,14 @@ class UserSerializer(serializers.ModelSerializer):
                   'last_name',
                   'password',
                   'is_subscribed',
-                  'recipes')
-        read_only_fields = ('id', 'is_subscribed', 'recipes')
+                  'recipes',
+                  'recipes_count')
+        read_only_fields = ('id', 'is_subscribed', 'recipes',
+                            'recipes_count')
 
     def get_is_subscribed(self, author):
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
         follower = self.context['view'].request.user
         if follower.is_anonymous:
             return False
@@ -104,6 +214,7 @@ class UserSerializer(serializers.ModelSerializer):
         password = validated_data.pop('password')
         hash_password = make_password(password)
         user = User.objects.create(**validated_data, password=hash_password)
+        user.limited_recipes = []
         return user
 
     def to_representation(self, instance):
@@ -112,7 +223,7 @@ class UserSerializer(serializers.ModelSerializer):
         return response
 
 
-class UserGetSerializer(serializers.ModelSerializer):
+class UserGetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Вспомогательный сериализатор для гет запросов."""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -126,6 +237,8 @@ class UserGetSerializer(serializers.ModelSerializer):
                   'is_subscribed')
 
     def get_is_subscribed(self, object):
+        if hasattr(object, 'is_subscribed'):
+            return object.is_subscribed
         user = self.context['request'].user
         if user.is_anonymous:
             return False
@@ -135,6 +248,29 @@ class UserGetSerializer(serializers.ModelSerializer):
         ).exists()
 
 
+# Поля автора для Recipe.objects.viewer_fields.
+AUTHOR_FIELDS = tuple(field for field in UserGetSerializer.Meta.fields
+                      if field != 'is_subscribed')
+
+
+def with_viewer_fields(fragment, viewer):
+    """
+    Ответ рецепта: фрагмент с полями из Recipe.objects.viewer_fields.
+    Автор берется из запроса, а не из фрагмента, поэтому изменения
+    пользователя не требуют сброса фрагментов его рецептов. Поля
+    автора - те же, что у UserGetSerializer.
+    """
+    data = dict(fragment)
+    data['author'] = {
+        field: viewer['author_is_subscribed' if field == 'is_subscribed'
+                      else f'author__{field}']
+        for field in UserGetSerializer.Meta.fields
+    }
+    data['is_favorited'] = viewer['is_favorited']
+    data['is_in_shopping_cart'] = viewer['is_in_shopping_cart']
+    return data
+
+
 class TokenCreateSerializer(serializers.Serializer):
     """
     Сериализатор для валидации данных, предоставленных пользователем
@@ -154,7 +290,58 @@ class TokenCreateSerializer(serializers.Serializer):
         fields = ('email', 'password',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+def create_recipe_relations(recipes_data):
+    """
+    Создает связи рецептов с тегами и ингредиентами пакетной вставкой.
+    recipes_data - последовательность троек (recipe, tags, ingredients).
+    """
+    tag_recipes = []
+    ingredient_recipes = []
+    for recipe, tags, ingredients in recipes_data:
+        tag_recipes.extend(TagRecipe(tag=tag, recipe=recipe) for tag in tags)
+        ingredient_recipes.extend(
+            IngredientRecipe(recipe=recipe,
+                             ingredient=ingredient['ingredient']['id'],
+                             amount=ingredient['amount'])
+            for ingredient in ingredients
+        )
+    TagRecipe.objects.bulk_create(tag_recipes)
+    IngredientRecipe.objects.bulk_create(ingredient_recipes)
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Сериализатор для создания нескольких рецептов одним запросом."""
+
+    @transaction.atomic
+    def create(self, validated_data):
+        relations = [
+            (attrs.pop('tags'), attrs.pop('ingredient_recipe'))
+            for attrs in validated_data
+        ]
+        for attrs, (_, ingredients) in zip(validated_data, relations):
+            attrs['ingredients_count'] = len(ingredients)
+        if connection.features.can_return_rows_from_bulk_insert:
+            recipes = Recipe.objects.bulk_create(
+                [Recipe(**attrs) for attrs in validated_data]
+            )
+            # bulk_create не отправляет post_save: счетчик рецептов
+            # автора, копии картинок и ленты подписчиков обновляются здесь.
+            increment_many(User, 'recipes_count',
+                           (recipe.author_id for recipe in recipes))
+            for recipe in recipes:
+                image_variants.schedule(recipe)
+            timeline.fan_out(recipes)
+        else:
+            recipes = [Recipe.objects.create(**attrs)
+                       for attrs in validated_data]
+        create_recipe_relations(
+            (recipe, tags, ingredients)
+            for recipe, (tags, ingredients) in zip(recipes, relations)
+        )
+        return recipes
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Основной сериализатор рецептов.
     Создание и обновление рецепта,
@@ -169,11 +356,13 @@ class RecipeSerializer(serializers.ModelSerializer):
         many=True
     )
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
+        list_serializer_class = RecipeListSerializer
         fields = ('id',
                   'tags',
                   'author',
@@ -182,41 +371,40 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'is_in_shopping_cart',
                   'name',
                   'image',
+                  'image_variants',
                   'text',
                   'cooking_time')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         if user.is_anonymous:
             return False
-        return Favourite.objects.filter(recipes=obj, user=user).exists()
+        return Favourite.objects.filter(recipe=obj, user=user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         if user.is_anonymous:
             return False
-        return ShoppingCart.objects.filter(recipes=obj, user=user).exists()
+        return ShoppingCart.objects.filter(recipe=obj, user=user).exists()
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredient_recipe')
-        recipe = Recipe.objects.create(**validated_data)
-        for tag in tags:
-            current_tag = Tag.objects.get(id=tag.id)
-            TagRecipe.objects.create(
-                tag=current_tag,
-                recipe=recipe
-            )
-        for ingredient in ingredients:
-            ingr_instance = ingredient['ingredient']['id']
-            IngredientRecipe.objects.create(
-                recipe=recipe,
-                ingredient=ingr_instance,
-                amount=ingredient.get('amount')
-            )
+        recipe = Recipe.objects.create(**validated_data,
+                                       ingredients_count=len(ingredients))
+        create_recipe_relations([(recipe, tags, ingredients)])
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        # Только редактируемые поля: счетчики и image_variants меняются
+        # параллельно сигналами и генерацией картинок.
+        update_fields = ['name', 'text', 'cooking_time', 'image']
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
         instance.cooking_time = validated_data.get('cooking_time',
@@ -227,19 +415,53 @@ class RecipeSerializer(serializers.ModelSerializer):
             instance.tags.set(tags_data)
 
         if 'ingredient_recipe' in validated_data:
-            instance.ingredient_recipe.all().delete()
             ingredients_data = validated_data.pop('ingredient_recipe')
-            for ingedient in ingredients_data:
-                ingedient_instance = ingedient['ingredient']['id']
-                ingredient_amount = ingedient['amount']
-                IngredientRecipe.objects.create(
-                    recipe=instance,
-                    ingredient=ingedient_instance,
-                    amount=ingredient_amount
-                )
-        instance.save()
+            new_amounts = {
+                ingedient['ingredient']['id'].id: ingedient['amount']
+                for ingedient in ingredients_data
+            }
+            old_amounts = self.sync_ingredients(instance, new_amounts)
+            instance.ingredients_count = len(new_amounts)
+            update_fields.append('ingredients_count')
+            ShoppingListItem.objects.apply_deltas(
+                ShoppingCart.objects.filter(
+                    recipe=instance
+                ).values_list('user_id', flat=True),
+                {pk: new_amounts.get(pk, 0) - old_amounts.get(pk, 0)
+                 for pk in old_amounts.keys() | new_amounts.keys()}
+            )
+        instance.save(update_fields=update_fields)
         return instance
 
+    @staticmethod
+    def sync_ingredients(recipe, new_amounts):
+        """
+        Приводит ингредиенты рецепта к new_amounts ({ingredient_id: amount}):
+        добавляет новые, обновляет изменившиеся количества и удаляет
+        убранные строки, не трогая остальные.
+        Возвращает прежние количества в том же формате.
+        """
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        old_amounts = {pk: row.amount for pk, row in existing.items()}
+        changed = []
+        for pk, row in existing.items():
+            if pk in new_amounts and row.amount != new_amounts[pk]:
+                row.amount = new_amounts[pk]
+                changed.append(row)
+        IngredientRecipe.objects.filter(
+            id__in=[row.id for pk, row in existing.items()
+                    if pk not in new_amounts]
+        ).delete()
+        IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in new_amounts.items() if pk not in existing
+        )
+        return old_amounts
+
     def to_representation(self, instance):
         response = super().to_representation(instance)
         response['tags'] = TagGetSerializer(
@@ -258,6 +480,14 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Все ингредиенты должны быть уникальны!'
             )
+        ingr_instances = Ingredient.objects.in_bulk(ingr_set)
+        for ingredient in ingredients:
+            pk = ingredient['ingredient']['id']
+            if pk not in ingr_instances:
+                raise serializers.ValidationError(
+                    f'Ингредиента с id={pk} не существует.'
+                )
+            ingredient['ingredient']['id'] = ingr_instances[pk]
         return ingredients
 
     def validate_tags(self, tags):
@@ -271,14 +501,30 @@ class RecipeSerializer(serializers.ModelSerializer):
         return tags
 
 
-class SubscriptionsSerializer(serializers.ModelSerializer):
-    """Сериализатор подписок."""
-
+class RecipesLimitSerializer(serializers.Serializer):
+    """Валидация параметра recipes_limit."""
     DEFAULT_LIMIT = 3
+    MAX_LIMIT = 100
+
+    recipes_limit = serializers.IntegerField(
+        min_value=0,
+        max_value=MAX_LIMIT,
+        default=DEFAULT_LIMIT
+    )
 
-    is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipesGetSerializer(many=True)
-    recipes_count = serializers.SerializerMethodField()
+
+class SubscriptionsSerializer(TimedSerializerMixin,
+                              serializers.ModelSerializer):
+    """
+    Сериализатор подписок.
+    Ожидает авторов с аннотацией is_subscribed
+    и с атрибутом limited_recipes - последними рецептами автора.
+    """
+    is_subscribed = serializers.BooleanField(read_only=True)
+    recipes = RecipesGetSerializer(source='limited_recipes',
+                                   many=True,
+                                   read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -291,23 +537,12 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
                   'recipes',
                   'recipes_count')
 
-    def get_is_subscribed(self, obj):
-        me = self.context['request'].user
-        return Follow.objects.filter(author=obj, follower=me).exists()
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.all().count()
 
-    def to_representation(self, instance):
-        response = super().to_representation(instance)
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit', self.DEFAULT_LIMIT)
-        response['recipes'] = response['recipes'][:int(limit)]
-        return response
-
-
-class FollowSerializer(serializers.ModelSerializer):
-    """Сериализатор создания подписки."""
+class FollowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Сериализатор создания подписки.
+    Ожидает автора с атрибутом limited_recipes - последними рецептами.
+    """
     email = serializers.EmailField(source='author.email',
                                    read_only=True)
     id = serializers.IntegerField(source='author.id',
@@ -319,10 +554,11 @@ class FollowSerializer(serializers.ModelSerializer):
     last_name = serializers.CharField(source='author.last_name',
                                       read_only=True)
     is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipesGetSerializer(source='author.recipes',
+    recipes = RecipesGetSerializer(source='author.limited_recipes',
                                    many=True,
                                    read_only=True)
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(source='author.recipes_count',
+                                             read_only=True)
 
     class Meta:
         model = Follow
@@ -349,6 +585,3 @@ class FollowSerializer(serializers.ModelSerializer):
             author=obj.author,
             follower=obj.follower
         ).exists()
-
-    def get_recipes_count(self, obj):
-        return len(obj.author.recipes.all())
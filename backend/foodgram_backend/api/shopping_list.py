@@ -0,0 +1,90 @@
+import csv
+import hashlib
+import json
+from itertools import chain, islice
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.encoding import smart_str
+
+# Списки не длиннее этого числа строк отдаются целиком,
+# с Content-Length и ETag; более длинные - потоком.
+BUFFERED_ROWS_LIMIT = 500
+ITERATOR_CHUNK_SIZE = 200
+
+
+class _Echo:
+    """Псевдо-буфер для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def _txt_rows(items):
+    separator = ''
+    for item in items:
+        yield (f"{separator}{item['name']}: ({item['measurement_unit']})"
+               f" - {item['amount']}, ")
+        separator = '\n'
+
+
+def _csv_rows(items):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for item in items:
+        yield writer.writerow(
+            (item['name'], item['measurement_unit'], item['amount'])
+        )
+
+
+def _json_rows(items):
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + json.dumps(
+            {'name': item['name'],
+             'measurement_unit': item['measurement_unit'],
+             'amount': item['amount']},
+            ensure_ascii=False
+        )
+        separator = ', '
+    yield ']'
+
+
+EXPORT_FORMATS = {
+    'txt': ('text/plain', _txt_rows),
+    'csv': ('text/csv', _csv_rows),
+    'json': ('application/json', _json_rows),
+}
+
+
+def shopping_list_response(request, items, export_format='txt'):
+    """
+    Возвращает файл со списком покупок в формате txt, csv или json.
+    items - итератор словарей с ключами name, measurement_unit и amount.
+    Короткий список собирается в памяти и отдается с Content-Length
+    и ETag, длинный - передается клиенту потоком по мере чтения из БД.
+    """
+    content_type, rows = EXPORT_FORMATS[export_format]
+    content_type = f'{content_type}; charset=utf-8'
+    items = iter(items)
+    head = list(islice(items, BUFFERED_ROWS_LIMIT + 1))
+
+    if len(head) <= BUFFERED_ROWS_LIMIT:
+        body = ''.join(rows(head)).encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type=content_type)
+            response['Content-Length'] = len(body)
+        response['ETag'] = etag
+    else:
+        response = StreamingHttpResponse(
+            (row.encode() for row in rows(chain(head, items))),
+            content_type=content_type
+        )
+    filename = f'shopping_cart.{export_format}'
+    response['Content-Disposition'] = (
+        f'attachment; filename={smart_str(filename)}'
+    )
+    return response
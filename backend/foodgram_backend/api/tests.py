@@ -0,0 +1,1214 @@
+import asyncio
+import base64
+import io
+import json
+import re
+import shutil
+import tempfile
+import textwrap
+from contextlib import ExitStack
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, F, Max, Min
+from django.http import HttpResponse
+from django.test import (AsyncClient, AsyncRequestFactory, RequestFactory,
+                         TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from recipes import (catalogue, checks, image_variants, ingredient_index,
+                     timeline)
+from recipes.cache_versions import bump_version
+from recipes.counters import COUNTERS, actual_count
+from recipes.models import (Favourite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe, TimelineEntry)
+from recipes.synthetic import INGREDIENTS_PER_RECIPE, Seeder
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient, APIRequestFactory
+from users.models import User
+
+from . import async_views
+from .authentication import TokenCache, token_cache
+from .middleware import RequestMetricsMiddleware
+from .pagination import RecipeCursorPagination
+from .serializers import Base64ImageField, RecipeSerializer, UserGetSerializer
+from .urls import async_urlpatterns
+
+
+class EmptySubscriptionsTests(TestCase):
+    """Подписки пользователя, который ни на кого не подписан."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def test_latest_per_author_without_authors(self):
+        self.assertEqual(Recipe.objects.latest_per_author([], 3), {})
+
+    def test_subscriptions(self):
+        for query in ('', '?cursor='):
+            with self.subTest(query=query):
+                response = self.client.get(
+                    f'/api/users/subscriptions/{query}'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['results'], [])
+
+    def test_users_page_without_users(self):
+        response = self.client.get('/api/users/?page=1&limit=1&username=x')
+        self.assertEqual(response.status_code, 200)
+
+
+class RequestMetricsMiddlewareTests(TestCase):
+    """Замеры запросов в синхронной и асинхронной цепочке."""
+
+    @staticmethod
+    def queries(response):
+        return int(re.search(r'"(\d+) queries"',
+                             response['Server-Timing']).group(1))
+
+    def test_async_capable(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertFalse(asyncio.iscoroutinefunction(
+            RequestMetricsMiddleware(lambda request: HttpResponse())
+        ))
+
+    def test_queries_counted(self):
+        sync_response = self.client.get('/api/recipes/')
+        async_response = async_to_sync(AsyncClient().get)('/api/recipes/')
+        self.assertEqual(async_response.status_code, 200)
+        self.assertGreater(self.queries(sync_response), 0)
+        self.assertEqual(self.queries(async_response),
+                         self.queries(sync_response))
+
+
+class IngredientIndexTests(TransactionTestCase):
+    """
+    Индекс ингредиентов строится один раз на процесс и пересобирается
+    в фоне, пока поиск отвечает по старому индексу.
+    """
+
+    def setUp(self):
+        ingredient_index.clear()
+        self.ingredient = Ingredient.objects.create(name='соль', units='г')
+
+    def tearDown(self):
+        ingredient_index.clear()
+
+    def first_name(self):
+        return ingredient_index.search('сол')[0]['name']
+
+    def rename_elsewhere(self):
+        # Изменение в другом процессе: сигналы здесь не срабатывают.
+        Ingredient.objects.filter(id=self.ingredient.id).update(name='солод')
+
+    def test_search_without_queries(self):
+        self.assertEqual(self.first_name(), 'соль')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.first_name(), 'соль')
+
+    def test_rebuilt_after_signal(self):
+        self.first_name()
+        self.ingredient.name = 'солод'
+        self.ingredient.save()
+        with self.assertNumQueries(0):
+            self.first_name()
+        ingredient_index.wait()
+        self.assertEqual(self.first_name(), 'солод')
+
+    @override_settings(SHARED_CACHE=True)
+    def test_rebuilt_when_version_changes(self):
+        self.first_name()
+        self.rename_elsewhere()
+        self.assertEqual(self.first_name(), 'соль')
+        ingredient_index.wait()
+        self.assertEqual(self.first_name(), 'соль')
+        bump_version('ingredients')
+        self.first_name()
+        ingredient_index.wait()
+        self.assertEqual(self.first_name(), 'солод')
+
+    def test_rebuilt_after_ttl(self):
+        self.first_name()
+        self.rename_elsewhere()
+        with override_settings(INGREDIENT_INDEX_TTL=0):
+            self.assertEqual(self.first_name(), 'соль')
+            ingredient_index.wait()
+        self.assertEqual(self.first_name(), 'солод')
+
+
+class ProcessLocalCacheTests(TestCase):
+    """Без общего кэша ответы не кэшируются."""
+
+    def test_changes_of_other_processes_visible(self):
+        tag = Tag.objects.create(name='Завтрак', hex_code='#E26C2D',
+                                 slug='breakfast')
+        self.client.get('/api/tags/')
+        # Изменение в другом процессе: версия здесь не увеличивается.
+        Tag.objects.filter(id=tag.id).update(name='Ужин')
+        self.assertEqual(self.client.get('/api/tags/').json()[0]['name'],
+                         'Ужин')
+
+
+class PartialSaveTests(TestCase):
+    """Редактирование не затирает счетчики, измененные параллельно."""
+
+    def test_recipe_update_keeps_counters(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        recipe = Recipe.objects.create(author=author, name='Суп',
+                                       text='Варить.', cooking_time=30)
+        stale = Recipe.objects.get(id=recipe.id)
+        Favourite.objects.create(user=author, recipe=recipe)
+        Recipe.objects.filter(id=recipe.id).update(
+            image_variants={'source': 'recipes/images/soup.png'}
+        )
+        RecipeSerializer().update(stale, {'name': 'Борщ'})
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Борщ')
+        self.assertEqual(recipe.favourites_count, 1)
+        self.assertEqual(recipe.image_variants,
+                         {'source': 'recipes/images/soup.png'})
+
+    def test_set_password_keeps_counters(self):
+        user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        User.objects.filter(id=user.id).update(followers_count=5)
+        response = client.post('/api/users/set_password/', {
+            'current_password': 'pw', 'new_password': 'Nw-pass-2026'
+        })
+        self.assertEqual(response.status_code, 204)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('Nw-pass-2026'))
+        self.assertEqual(user.followers_count, 5)
+
+
+class TokenCacheTests(TestCase):
+    """Кэш токенов хранит только id и is_active пользователя."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+
+    def test_entry_without_password(self):
+        tokens = TokenCache(timeout=60, max_size=10)
+        tokens.set('key', self.user, tokens.generation)
+        self.assertEqual(list(tokens._entries['key'][:2]),
+                         [self.user.id, True])
+        user = tokens.get('key')
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'reader')
+
+    def test_shared_revocation(self):
+        # Два процесса с общим кэшем.
+        first = TokenCache(timeout=60, max_size=10, shared=True)
+        second = TokenCache(timeout=60, max_size=10, shared=True)
+        first.set('key', self.user, first.generation)
+        first.set('other', self.user, first.generation)
+        self.assertEqual(second.get('key'), self.user)
+        second.invalidate('key')
+        self.assertIsNone(first.get('key'))
+        self.assertEqual(first.get('other'), self.user)
+        # Пользователь, прочитанный до удаления, не сохраняется.
+        first.set('key', self.user, first.generation)
+        self.assertIsNone(second.get('key'))
+
+
+@override_settings(SHARED_CACHE=True)
+class TokenRevocationTests(TestCase):
+    """Отозванный токен отклоняется на следующем запросе."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.addCleanup(setattr, token_cache, 'shared', token_cache.shared)
+        token_cache.shared = True
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def test_logout(self):
+        self.assertEqual(self.me(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/auth/token/logout/')
+        self.assertEqual(self.me(), 401)
+
+    def test_deactivated(self):
+        self.assertEqual(self.me(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.me(), 401)
+
+    def test_signup_keeps_other_tokens(self):
+        self.assertEqual(self.me(), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(username='writer',
+                                     email='writer@example.com',
+                                     password='pw')
+        # Токен из кэша: только запросы самого /users/me/.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.me(), 200)
+
+
+class Base64ImageFieldTests(TestCase):
+    """Картинки рецептов в data URI."""
+
+    @staticmethod
+    def png():
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), 'red').save(buffer, 'PNG')
+        return base64.b64encode(buffer.getvalue()).decode()
+
+    def test_wrapped_base64(self):
+        data = 'data:image/png;base64,' + textwrap.fill(self.png(), 76)
+        file = Base64ImageField().to_internal_value(data)
+        self.assertEqual(file.name, 'temp.png')
+
+    def test_chunks_split_by_whitespace(self):
+        field = Base64ImageField()
+        field.DECODE_CHUNK_SIZE = 7
+        data = 'data:image/png;base64,' + textwrap.fill(self.png(), 10)
+        self.assertEqual(field.to_internal_value(data).read(),
+                         base64.b64decode(self.png()))
+
+    def test_max_size(self):
+        size = len(base64.b64decode(self.png()))
+        data = 'data:image/png;base64,' + textwrap.fill(self.png(), 76)
+        Base64ImageField(max_size=size).to_internal_value(data)
+        for max_size in (size - 1, size - 10):
+            with self.subTest(max_size=max_size):
+                with self.assertRaises(ValidationError):
+                    Base64ImageField(max_size=max_size).to_internal_value(
+                        data
+                    )
+
+    def test_body_limit_fits_bulk(self):
+        self.assertGreaterEqual(settings.DATA_UPLOAD_MAX_MEMORY_SIZE,
+                                settings.RECIPE_BULK_MAX_SIZE)
+
+
+class SearchObjectsTests(TestCase):
+    """Объекты полнотекстового поиска вне состояния миграций."""
+
+    def test_present_after_migrations(self):
+        self.assertEqual(
+            checks.check_search_objects(None, databases=['default']), []
+        )
+
+    def test_missing_reported(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite triggers')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER recipes_recipe_search_update')
+        errors = checks.check_search_objects(None, databases=['default'])
+        self.assertEqual([error.id for error in errors], ['recipes.E001'])
+
+
+class AddRecipeTests(TestCase):
+    """Повторное добавление в избранное, корзину и подписки."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(author=self.user, name='Суп',
+                                            text='Варить.', cooking_time=30)
+        self.ingredient = Ingredient.objects.create(name='соль', units='г')
+        IngredientRecipe.objects.create(recipe=self.recipe,
+                                        ingredient=self.ingredient, amount=5)
+
+    def post_twice(self, action):
+        url = f'/api/recipes/{self.recipe.id}/{action}/'
+        first, second = self.client.post(url), self.client.post(url)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 400)
+
+    def test_favorite(self):
+        self.post_twice('favorite')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favourites_count, 1)
+
+    def test_shopping_cart(self):
+        self.post_twice('shopping_cart')
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list('amount', flat=True)),
+            [5]
+        )
+
+    def test_subscribe(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        for url in (f'/api/users/{author.id}/subscribe/',
+                    f'/api/recipes/{self.recipe.id}/subscribe/'):
+            with self.subTest(url=url):
+                Recipe.objects.filter(id=self.recipe.id).update(author=author)
+                first = self.client.post(url)
+                self.assertEqual(first.status_code, 201)
+                self.assertEqual(first.json()['id'], author.id)
+                self.assertEqual(self.client.post(url).status_code, 400)
+                author.refresh_from_db()
+                self.assertEqual(author.followers_count, 1)
+                self.assertEqual(self.client.delete(url).status_code, 204)
+
+    def test_subscribe_recipes_limit(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        for number in range(5):
+            Recipe.objects.create(author=author, name=f'Суп {number}',
+                                  text='Варить.', cooking_time=30)
+        url = f'/api/users/{author.id}/subscribe/'
+        self.assertEqual(self.client.post(f'{url}?recipes_limit=x')
+                         .status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+        for query, count in (('?recipes_limit=1', 1), ('', 3)):
+            with self.subTest(query=query):
+                response = self.client.post(url + query)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(len(response.json()['recipes']), count)
+                self.client.delete(url)
+
+
+class HaveFilterTests(TestCase):
+    """Параметр have - список id ингредиентов."""
+
+    def test_values(self):
+        ids = ','.join(map(str, range(1, 52)))
+        for query, code in (('1,2', 200), ('1.0', 200), ('1.5', 400),
+                            ('x', 400), (ids[:ids.rindex(',')], 200),
+                            (ids, 400)):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/recipes/?have={query}')
+                self.assertEqual(response.status_code, code)
+
+    def test_async_values(self):
+        request = AsyncRequestFactory().get('/api/recipes/?have=1.5')
+        response = async_to_sync(async_views.recipe_list)(request)
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(SHARED_CACHE=True)
+class RecipeDetailTests(TransactionTestCase):
+    """Автор в ответе из кэша фрагментов - как у UserGetSerializer."""
+
+    def test_author_fields(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw',
+            first_name='Анна', last_name='Иванова'
+        )
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        recipe = Recipe.objects.create(author=author, name='Суп',
+                                       text='Варить.', cooking_time=30)
+        client = APIClient()
+        client.force_authenticate(reader)
+        request = APIRequestFactory().get('/')
+        request.user = reader
+        expected = UserGetSerializer(author,
+                                     context={'request': request}).data
+        token = Token.objects.create(user=reader)
+        async_request = AsyncRequestFactory().get(
+            f'/api/recipes/{recipe.id}/', authorization=f'Token {token}'
+        )
+        responses = [
+            client.get(f'/api/recipes/{recipe.id}/').json(),
+            client.get(f'/api/recipes/{recipe.id}/').json(),
+            json.loads(async_to_sync(async_views.recipe_detail)(
+                async_request, pk=recipe.id
+            ).content),
+        ]
+        for response in responses:
+            self.assertEqual(response['author'], expected)
+
+
+class CursorTraversalMixin:
+    """Обход keyset-пагинации по ссылкам next."""
+
+    def traverse(self, url):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url).json()
+            pages.append([recipe['id'] for recipe in response['results']])
+            ids.extend(pages[-1])
+            url = response['next']
+        self.assertGreater(len(pages), 1)
+        if len(pages[-1]) == len(pages[-2]):
+            previous = self.client.get(response['previous']).json()
+            self.assertEqual([recipe['id'] for recipe in previous['results']],
+                             pages[-2])
+        return ids
+
+
+class RankedCursorTests(CursorTraversalMixin, TestCase):
+    """Курсор поиска и подбора по ингредиентам сохраняет их порядок."""
+
+    def setUp(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        ingredients = [Ingredient.objects.create(name=f'и{number}', units='г')
+                       for number in range(4)]
+        self.have = [ingredients[0].id, ingredients[1].id]
+        for number in range(15):
+            words = ' '.join(['суп'] * (number % 4 + 1))
+            recipe = Recipe.objects.create(
+                author=author, name=f'Суп {number}' if number % 3 else 'Щи',
+                text=f'Варить {words}.', cooking_time=10
+            )
+            for ingredient in ingredients[:number % 4 + 1]:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+
+    def test_search(self):
+        expected = list(Recipe.objects.search('суп').values_list(
+            'id', flat=True
+        ))
+        query = urlencode({'search': 'суп', 'cursor': ''})
+        self.assertEqual(self.traverse(f'/api/recipes/?{query}'), expected)
+
+    def test_have(self):
+        have = ','.join(map(str, self.have))
+        expected = list(Recipe.objects.by_coverage(self.have).values_list(
+            'id', flat=True
+        ))
+        self.assertEqual(len(expected), 15)
+        self.assertEqual(self.traverse(f'/api/recipes/?have={have}&cursor='),
+                         expected)
+
+
+@mock.patch.object(RecipeCursorPagination, 'page_size', 3)
+class RecipeCursorTests(CursorTraversalMixin, TestCase):
+    """
+    Курсор ленты рецептов: ссылки next сохраняют фильтры, а новые
+    рецепты не сдвигают уже открытые страницы.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        self.tags = [Tag.objects.create(name=f'Тег {number}',
+                                        hex_code='#FFFFFF',
+                                        slug=f'tag{number}')
+                     for number in range(2)]
+        for number in range(20):
+            recipe = Recipe.objects.create(
+                author=self.author if number % 2 else self.user,
+                name=f'Суп {number}', text='Варить.', cooking_time=10
+            )
+            for tag in self.tags[:number % 3]:
+                TagRecipe.objects.create(recipe=recipe, tag=tag)
+            if number % 3:
+                Favourite.objects.create(user=self.user, recipe=recipe)
+            if number % 4:
+                ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def expected(self, recipes):
+        return list(recipes.distinct().order_by(
+            '-publication_date', '-id'
+        ).values_list('id', flat=True))
+
+    def test_filters(self):
+        cases = (
+            ('tags=tag1', Recipe.objects.filter(tags__slug='tag1')),
+            ('tags=tag0&tags=tag1',
+             Recipe.objects.filter(tags__slug__in=['tag0', 'tag1'])),
+            (f'author={self.author.id}',
+             Recipe.objects.filter(author=self.author)),
+            ('is_favorited=1',
+             Recipe.objects.filter(favourite__user=self.user)),
+            ('is_in_shopping_cart=1',
+             Recipe.objects.filter(shoppingcart__user=self.user)),
+            ('tags=tag0&is_favorited=1&is_in_shopping_cart=1',
+             Recipe.objects.filter(tags__slug='tag0',
+                                   favourite__user=self.user,
+                                   shoppingcart__user=self.user)),
+        )
+        for query, recipes in cases:
+            with self.subTest(query=query):
+                expected = self.expected(recipes)
+                self.assertTrue(expected)
+                self.assertEqual(
+                    self.traverse(f'/api/recipes/?{query}&cursor='), expected
+                )
+
+    def test_repeated(self):
+        url = '/api/recipes/?is_favorited=1&cursor='
+        self.assertEqual(self.traverse(url), self.traverse(url))
+
+    def test_new_recipes(self):
+        expected = self.expected(Recipe.objects.all())
+        response = self.client.get('/api/recipes/?cursor=').json()
+        ids = [recipe['id'] for recipe in response['results']]
+        for number in range(5):
+            Recipe.objects.create(author=self.author, name=f'Щи {number}',
+                                  text='Варить.', cooking_time=10)
+        self.assertEqual(ids + self.traverse(response['next']), expected)
+
+
+@mock.patch.object(RecipeCursorPagination, 'page_size', 3)
+@override_settings(FEED_FANOUT_THRESHOLD=3)
+class FeedTests(CursorTraversalMixin, TestCase):
+    """
+    Лента подписок из таймлайнов и рецептов популярных авторов
+    совпадает с лентой, собранной соединением подписок с рецептами.
+    """
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'user{number}',
+                                     email=f'user{number}@example.com',
+                                     password='pw')
+            for number in range(4)
+        ]
+        self.reader, self.popular, self.quiet, self.stranger = self.users
+        self.fans = [
+            User.objects.create_user(username=f'fan{number}',
+                                     email=f'fan{number}@example.com',
+                                     password='pw')
+            for number in range(2)
+        ]
+        self.publish(self.popular, self.quiet, self.stranger)
+        for follower in [self.reader, *self.fans]:
+            self.subscribe(follower, self.popular)
+        self.subscribe(self.reader, self.quiet)
+        self.publish(self.popular, self.quiet, self.stranger)
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def publish(self, *authors):
+        for number in range(3):
+            for author in authors:
+                Recipe.objects.create(author=author, name=f'Суп {number}',
+                                      text='Варить.', cooking_time=10)
+
+    def subscribe(self, follower, author, method='post'):
+        client = APIClient()
+        client.force_authenticate(follower)
+        response = getattr(client, method)(
+            f'/api/users/{author.id}/subscribe/'
+        )
+        self.assertIn(response.status_code, (201, 204))
+
+    def expected(self, user):
+        return list(Recipe.objects.filter(
+            author__following__follower=user
+        ).order_by('-publication_date', '-id').values_list('id', flat=True))
+
+    def timelines(self):
+        return set(TimelineEntry.objects.values_list(
+            'user_id', 'recipe_id', 'publication_date'
+        ))
+
+    def test_popular_author(self):
+        self.assertEqual(
+            User.objects.get(id=self.popular.id).followers_count, 3
+        )
+        # The third follower made the author popular: only the recipes
+        # published before are copied, to the first two followers.
+        self.assertEqual(TimelineEntry.objects.filter(
+            recipe__author=self.popular
+        ).count(), 2 * 3)
+        self.assertEqual(self.traverse('/api/recipes/feed/'),
+                         self.expected(self.reader))
+
+    def test_rebuilt_timelines(self):
+        # Recipes copied before the author became popular stay in the
+        # timelines, a rebuild leaves them out.
+        self.assertLess(set(timeline.entries()), self.timelines())
+        for threshold in (0, 1000):
+            with self.subTest(threshold=threshold):
+                with override_settings(FEED_FANOUT_THRESHOLD=threshold):
+                    timeline.rebuild()
+                    self.assertEqual(
+                        bool(TimelineEntry.objects.exists()), bool(threshold)
+                    )
+                    self.assertEqual(self.traverse('/api/recipes/feed/'),
+                                     self.expected(self.reader))
+        timeline.rebuild()
+        self.assertEqual(self.timelines(), set(timeline.entries()))
+        self.assertEqual(self.traverse('/api/recipes/feed/'),
+                         self.expected(self.reader))
+
+    def test_backfill(self):
+        self.subscribe(self.fans[1], self.popular, 'delete')
+        self.assertEqual(
+            User.objects.get(id=self.popular.id).followers_count, 2
+        )
+        self.assertEqual(self.timelines(), set(timeline.entries()))
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.reader, recipe__author=self.popular
+        ).count(), 6)
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.fans[1]
+        ).exists())
+        self.publish(self.popular)
+        self.assertEqual(self.traverse('/api/recipes/feed/'),
+                         self.expected(self.reader))
+        self.client.force_authenticate(self.fans[0])
+        self.assertEqual(self.traverse('/api/recipes/feed/'),
+                         self.expected(self.fans[0]))
+
+
+class SeederTests(TestCase):
+    """Синтетические данные."""
+
+    def test_publication_dates(self):
+        Seeder(5, 20, days=30, use_copy=False).run()
+        dates = Recipe.objects.aggregate(first=Min('publication_date'),
+                                         last=Max('publication_date'))
+        span = dates['last'] - dates['first']
+        self.assertGreater(span, timedelta(days=28))
+        self.assertLessEqual(span, timedelta(days=30))
+        self.assertLess(dates['first'], timezone.now() - timedelta(days=29))
+
+    def test_row_counts(self):
+        written = Seeder(8, 40, follows=3, favourites=5, carts=2,
+                         use_copy=False).run()
+        self.assertEqual(written[User], 8)
+        self.assertEqual(written[Recipe], 40)
+        self.assertEqual(written[ShoppingCart], 8 * 2)
+        for model, count in written.items():
+            with self.subTest(model=model.__name__):
+                self.assertEqual(model.objects.count(), count)
+        self.assertFalse(Recipe.objects.exclude(
+            ingredients_count__range=INGREDIENTS_PER_RECIPE
+        ).exists())
+        self.assertEqual(TagRecipe.objects.values('recipe').distinct().count(),
+                         40)
+        for name, (model, field, counted_model, foreign_key) in (
+                COUNTERS.items()):
+            with self.subTest(counter=name):
+                self.assertFalse(model.objects.annotate(
+                    actual=actual_count(counted_model, foreign_key)
+                ).exclude(**{field: F('actual')}).exists())
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )),
+            {(row['user_id'], row['ingredient_id'], row['total'])
+             for row in ShoppingListItem.objects.from_carts()}
+        )
+        entries = set(timeline.entries())
+        self.assertTrue(entries)
+        self.assertEqual(set(TimelineEntry.objects.values_list(
+            'user_id', 'recipe_id', 'publication_date'
+        )), entries)
+
+
+class AsyncViewsTests(TransactionTestCase):
+    """
+    Async-представления отдают тот же ответ, что и синхронные. Они
+    читают БД из потоков пула, поэтому данные тестов закоммичены.
+    """
+
+    def setUp(self):
+        ingredient_index.clear()
+        self.addCleanup(ingredient_index.clear)
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        self.token = Token.objects.create(user=reader)
+        Follow.objects.create(author=author, follower=reader)
+        self.tag = Tag.objects.create(name='Обед', hex_code='#FFFFFF',
+                                      slug='lunch')
+        ingredient = Ingredient.objects.create(name='соль', units='г')
+        for number in range(3):
+            self.recipe = Recipe.objects.create(
+                author=author, name=f'Суп {number}', text='Варить.',
+                cooking_time=10
+            )
+            TagRecipe.objects.create(recipe=self.recipe, tag=self.tag)
+            IngredientRecipe.objects.create(
+                recipe=self.recipe, ingredient=ingredient, amount=number + 1
+            )
+        Favourite.objects.create(user=reader, recipe=self.recipe)
+
+    def responses(self, route, token=True):
+        path = route.partition('?')[0]
+        for pattern in async_urlpatterns:
+            match = pattern.resolve(path)
+            if match:
+                break
+        header = f'Token {self.token}' if token else ''
+        sync_response = match.func.sync_view(
+            RequestFactory().get(f'/api/{route}', HTTP_AUTHORIZATION=header),
+            **match.kwargs
+        )
+        sync_response.render()
+        async_response = async_to_sync(match.func.async_view)(
+            AsyncRequestFactory().get(f'/api/{route}', authorization=header),
+            **match.kwargs
+        )
+        return sync_response, async_response
+
+    def test_same_payload(self):
+        for route in (
+            'recipes/', 'recipes/?limit=2&page=2', 'recipes/?cursor=&limit=2',
+            'recipes/?is_favorited=1', 'recipes/?have=x',
+            f'recipes/{self.recipe.id}/', 'recipes/0/',
+            'users/subscriptions/?recipes_limit=1',
+            'users/subscriptions/?cursor=', 'ingredients/',
+            'ingredients/?name=со', 'tags/', f'tags/{self.tag.id}/',
+            'tags/0/',
+        ):
+            with self.subTest(route=route):
+                sync_response, async_response = self.responses(route)
+                self.assertEqual(async_response.status_code,
+                                 sync_response.status_code)
+                self.assertEqual(json.loads(async_response.content),
+                                 json.loads(sync_response.content))
+
+    def test_anonymous_subscriptions(self):
+        sync_response, async_response = self.responses(
+            'users/subscriptions/', token=False
+        )
+        self.assertEqual(async_response.status_code, 401)
+        self.assertEqual(json.loads(async_response.content),
+                         json.loads(sync_response.content))
+
+
+@override_settings(RECIPE_IMAGE_VARIANT_WORKERS=1)
+class ImageVariantsTests(TransactionTestCase):
+    """
+    Копии картинки рецепта строятся в пуле потоков и удаляются при
+    замене картинки и удалении рецепта.
+    """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_settings = override_settings(MEDIA_ROOT=media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(image_variants.shutdown)
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+
+    @staticmethod
+    def image(color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), color).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name='soup.png')
+
+    @staticmethod
+    def variant_files(recipe):
+        image_variants.shutdown()
+        recipe.refresh_from_db()
+        return image_variants.file_names(recipe.image_variants)
+
+    def test_files(self):
+        recipe = Recipe.objects.create(author=self.author, name='Суп',
+                                       text='Варить.', cooking_time=30,
+                                       image=self.image('red'))
+        first = self.variant_files(recipe)
+        self.assertTrue(image_variants.is_current(recipe))
+        self.assertEqual(len(first), len(settings.RECIPE_IMAGE_VARIANTS)
+                         * len(image_variants.FORMATS))
+        self.assertTrue(all(map(default_storage.exists, first)))
+        recipe.image = self.image('blue')
+        recipe.save()
+        second = self.variant_files(recipe)
+        self.assertTrue(image_variants.is_current(recipe))
+        self.assertTrue(all(map(default_storage.exists, second)))
+        self.assertFalse(any(map(default_storage.exists, first)))
+        recipe.delete()
+        image_variants.shutdown()
+        self.assertFalse(any(map(default_storage.exists, second)))
+
+    def test_failure_logged(self):
+        with self.assertLogs('recipes.image_variants', 'ERROR'):
+            image_variants.submit(lambda: 1 / 0)
+            image_variants.shutdown()
+
+
+class RecipeListQueriesTests(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        tags = [Tag.objects.create(name=f'Тег {number}', hex_code='#FFFFFF',
+                                   slug=f'tag{number}')
+                for number in range(2)]
+        ingredients = [Ingredient.objects.create(name=f'и{number}',
+                                                 units='г')
+                       for number in range(3)]
+        for number in range(12):
+            recipe = Recipe.objects.create(
+                author=self.user, name=f'Суп {number}', text='Варить.',
+                cooking_time=10
+            )
+            for tag in tags:
+                TagRecipe.objects.create(recipe=recipe, tag=tag)
+            for ingredient in ingredients:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1
+                )
+            if number % 2:
+                Favourite.objects.create(user=self.user, recipe=recipe)
+
+    def count_queries(self, client, url, page_size):
+        pagination_classes = (PageNumberPagination, RecipeCursorPagination)
+        with ExitStack() as stack:
+            for pagination_class in pagination_classes:
+                stack.enter_context(mock.patch.object(
+                    pagination_class, 'page_size', page_size
+                ))
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+        self.assertEqual(len(response.json()['results']), page_size)
+        return len(queries)
+
+    def test_page_sizes(self):
+        authenticated = APIClient()
+        authenticated.force_authenticate(self.user)
+        for client in (APIClient(), authenticated):
+            for url in ('/api/recipes/', '/api/recipes/?cursor='):
+                with self.subTest(url=url, user=client is authenticated):
+                    counts = {self.count_queries(client, url, page_size)
+                              for page_size in (1, 5, 12)}
+                    self.assertEqual(len(counts), 1)
+
+
+class ShoppingListExportTests(TestCase):
+    """Выгрузка списка покупок целиком и потоком."""
+
+    EXPECTED = {
+        'txt': 'мука: (г) - 500, \nсоль: (г) - 5, \nяйца: (шт) - 2, ',
+        'csv': ('name,measurement_unit,amount\r\nмука,г,500\r\n'
+                'соль,г,5\r\nяйца,шт,2\r\n'),
+        'json': json.dumps([
+            {'name': 'мука', 'measurement_unit': 'г', 'amount': 500},
+            {'name': 'соль', 'measurement_unit': 'г', 'amount': 5},
+            {'name': 'яйца', 'measurement_unit': 'шт', 'amount': 2},
+        ], ensure_ascii=False),
+    }
+    URL = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        for name, units, amount in (('соль', 'г', 5), ('яйца', 'шт', 2),
+                                    ('мука', 'г', 500)):
+            ShoppingListItem.objects.create(
+                user=user, amount=amount,
+                ingredient=Ingredient.objects.create(name=name, units=units)
+            )
+
+    def test_buffered(self):
+        for export_format, expected in self.EXPECTED.items():
+            with self.subTest(format=export_format):
+                response = self.client.get(
+                    f'{self.URL}?format={export_format}'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.streaming)
+                self.assertEqual(response.content.decode(), expected)
+                self.assertEqual(int(response['Content-Length']),
+                                 len(response.content))
+                self.assertEqual(
+                    response['Content-Disposition'],
+                    f'attachment; filename=shopping_cart.{export_format}'
+                )
+                cached = self.client.get(f'{self.URL}?format={export_format}',
+                                         HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(cached.status_code, 304)
+
+    @mock.patch('api.shopping_list.BUFFERED_ROWS_LIMIT', 2)
+    def test_streamed(self):
+        for export_format, expected in self.EXPECTED.items():
+            with self.subTest(format=export_format):
+                response = self.client.get(
+                    f'{self.URL}?format={export_format}'
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.streaming)
+                self.assertFalse(response.has_header('Content-Length'))
+                self.assertFalse(response.has_header('ETag'))
+                self.assertEqual(
+                    b''.join(response.streaming_content).decode(), expected
+                )
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Миграции до migrate_to: данные создаются в состоянии migrate_from
+    историческими моделями self.apps, migrate() применяет migrate_to.
+    Счетчики пользователей (users.0002) появились позже, поэтому
+    migrate_from откатывает и users.
+    """
+    migrate_from = migrate_to = None
+
+    def setUp(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes()
+        self.addCleanup(self.migrate, latest)
+        self.apps = self.migrate(self.migrate_from)
+
+    @staticmethod
+    def migrate(targets=None):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def create_recipe(self, author, ingredients):
+        recipe = self.apps.get_model('recipes', 'Recipe').objects.create(
+            author_id=author.id, name='Суп', text='Варить.', cooking_time=10
+        )
+        for ingredient, amount in ingredients.items():
+            self.apps.get_model('recipes', 'IngredientRecipe').objects.create(
+                recipe=recipe, ingredient_id=ingredient.id, amount=amount
+            )
+        return recipe
+
+
+class ShoppingListMigrationTests(MigrationTestCase):
+    """Список покупок, заполненный миграцией 0003 по корзинам."""
+    migrate_from = [('recipes', '0002_initial'), ('users', '0001_initial')]
+    migrate_to = [('recipes', '0003_shoppinglistitem')]
+
+    def test_fill(self):
+        users = [
+            self.apps.get_model('users', 'User').objects.create(
+                username=f'user{number}', email=f'user{number}@example.com'
+            )
+            for number in range(3)
+        ]
+        salt, flour, eggs = (
+            self.apps.get_model('recipes', 'Ingredient').objects.create(
+                name=name, units='г'
+            )
+            for name in ('соль', 'мука', 'яйца')
+        )
+        soup = self.create_recipe(users[0], {salt: 5, flour: 100})
+        pie = self.create_recipe(users[0], {flour: 300, eggs: 2})
+        carts = self.apps.get_model('recipes', 'ShoppingCart').objects
+        # До 0006 каждое добавление создавало отдельную корзину,
+        # и рецепт мог оказаться в двух корзинах пользователя.
+        for user, recipe in ((users[1], soup), (users[1], pie),
+                             (users[1], soup), (users[2], pie)):
+            carts.create(user_id=user.id).recipes.add(recipe)
+        apps = self.migrate(self.migrate_to)
+        items = apps.get_model('recipes', 'ShoppingListItem').objects
+        self.assertEqual(
+            {(item.user_id, item.ingredient_id): item.amount
+             for item in items.all()},
+            {(users[1].id, salt.id): 5, (users[1].id, flour.id): 400,
+             (users[1].id, eggs.id): 2, (users[2].id, flour.id): 300,
+             (users[2].id, eggs.id): 2}
+        )
+
+
+class FlattenMigrationTests(MigrationTestCase):
+    """Избранное и корзины после 0006 и 0007 - по строке на пару."""
+    migrate_from = [('recipes', '0005_relation_constraints'),
+                    ('users', '0001_initial')]
+    migrate_to = [('recipes', '0007_remove_recipe_favourite_shopping_cart')]
+
+    def test_flatten(self):
+        users = [
+            self.apps.get_model('users', 'User').objects.create(
+                username=f'user{number}', email=f'user{number}@example.com'
+            )
+            for number in range(2)
+        ]
+        recipes = [self.create_recipe(users[0], {}) for _ in range(3)]
+        expected = {}
+        for model_name in ('Favourite', 'ShoppingCart'):
+            containers = self.apps.get_model('recipes', model_name).objects
+            # Контейнер с двумя рецептами, повтор рецепта в другом
+            # контейнере и пустой контейнер.
+            containers.create(user_id=users[0].id).recipes.add(*recipes[:2])
+            containers.create(user_id=users[0].id).recipes.add(recipes[1])
+            containers.create(user_id=users[1].id).recipes.add(recipes[2])
+            containers.create(user_id=users[1].id)
+            expected[model_name] = [
+                (users[0].id, recipes[0].id), (users[0].id, recipes[1].id),
+                (users[1].id, recipes[2].id),
+            ]
+        apps = self.migrate(self.migrate_to)
+        for model_name, pairs in expected.items():
+            with self.subTest(model=model_name):
+                self.assertEqual(
+                    sorted(apps.get_model('recipes', model_name).objects
+                           .values_list('user_id', 'recipe_id')),
+                    pairs
+                )
+
+
+class SyncIngredientsTests(TestCase):
+    """Изменение ингредиентов рецепта затрагивает только нужные строки."""
+
+    def test_patch(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        client = APIClient()
+        client.force_authenticate(author)
+        recipe = Recipe.objects.create(author=author, name='Суп',
+                                       text='Варить.', cooking_time=30)
+        salt, flour, eggs, sugar = (
+            Ingredient.objects.create(name=name, units='г')
+            for name in ('соль', 'мука', 'яйца', 'сахар')
+        )
+        before = {
+            ingredient: IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            ).id
+            for ingredient, amount in ((salt, 5), (flour, 100), (eggs, 2))
+        }
+        client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        response = client.patch(f'/api/recipes/{recipe.id}/', {
+            'ingredients': [{'id': salt.id, 'amount': 5},
+                            {'id': flour.id, 'amount': 200},
+                            {'id': sugar.id, 'amount': 10}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        rows = {row.ingredient_id: row for row
+                in IngredientRecipe.objects.filter(recipe=recipe)}
+        self.assertEqual({pk: row.amount for pk, row in rows.items()},
+                         {salt.id: 5, flour.id: 200, sugar.id: 10})
+        self.assertEqual(rows[salt.id].id, before[salt])
+        self.assertEqual(rows[flour.id].id, before[flour])
+        self.assertNotIn(rows[sugar.id].id, before.values())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.ingredients_count, 3)
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(user=author)
+                 .values_list('ingredient_id', 'amount')),
+            {salt.id: 5, flour.id: 200, sugar.id: 10}
+        )
+
+
+class RecipesLimitTests(TestCase):
+    """Параметр recipes_limit подписок и профилей."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pw'
+        )
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pw'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(reader)
+        self.recipes = [
+            Recipe.objects.create(author=self.author, name=f'Суп {number}',
+                                  text='Варить.', cooking_time=10).id
+            for number in range(5)
+        ]
+        self.client.post(f'/api/users/{self.author.id}/subscribe/')
+
+    def test_limits(self):
+        latest = self.recipes[::-1]
+        for query, expected in (('', latest[:3]), ('?recipes_limit=0', []),
+                                ('?recipes_limit=2', latest[:2]),
+                                ('?recipes_limit=100', latest)):
+            for url in ('/api/users/subscriptions/',
+                        '/api/users/subscriptions/?cursor=',
+                        '/api/users/'):
+                url += query if '?' not in url else query.replace('?', '&')
+                with self.subTest(url=url):
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    author = next(user for user in response.json()['results']
+                                  if user['id'] == self.author.id)
+                    self.assertEqual(
+                        [recipe['id'] for recipe in author['recipes']],
+                        expected
+                    )
+            response = self.client.get(f'/api/users/{self.author.id}/{query}')
+            self.assertEqual(len(response.json()['recipes']), len(expected))
+
+    def test_invalid(self):
+        for value in ('x', '1.5', '-1', '101'):
+            for url in ('/api/users/subscriptions/', '/api/users/',
+                        f'/api/users/{self.author.id}/'):
+                with self.subTest(url=url, value=value):
+                    response = self.client.get(f'{url}?recipes_limit={value}')
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('recipes_limit', response.json())
+
+
+class LoadDataTests(TestCase):
+    """Повторная загрузка каталога не создает дубликатов."""
+
+    def load(self, *args):
+        out = io.StringIO()
+        call_command('load_data', *args, stdout=out)
+        return out.getvalue()
+
+    def duplicates(self, model, *key):
+        return model.objects.values(*key).annotate(
+            rows=Count('id')
+        ).filter(rows__gt=1)
+
+    def test_twice(self):
+        self.load()
+        counts = (Ingredient.objects.count(), Tag.objects.count())
+        data_dir = Path(settings.BASE_DIR, 'ingredients_tags_data')
+        self.assertEqual(counts, tuple(
+            len(list(catalogue.read_rows(data_dir / name)))
+            for name in ('ingredients.csv', 'tags.csv')
+        ))
+        path = data_dir / 'ingredients.json'
+        for args in ((), ('--batch-size', '7'), ('--ingredients', path)):
+            with self.subTest(args=args):
+                output = self.load(*args)
+                self.assertIn('ingredients: 0 new, 0 changed', output)
+                self.assertIn('tags: 0 new, 0 changed', output)
+                self.assertEqual(
+                    (Ingredient.objects.count(), Tag.objects.count()), counts
+                )
+        self.assertFalse(self.duplicates(Ingredient, 'name', 'units'))
+        self.assertFalse(self.duplicates(Tag, 'slug'))
@@ -1,8 +1,11 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
 from .views import (IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet,
-                    create_token, detele_token)
+                    create_token, detele_token, metrics)
 
 app_name = 'api'
 
@@ -14,8 +17,60 @@ router_v1.register('tags', TagViewSet, basename='tag')
 router_v1.register('users', UserViewSet, basename='user')
 
 
+def read_async(async_view, sync_view):
+    """
+    GET обрабатывает async_view, остальные методы - синхронный
+    sync_view того же адреса. Оба представления доступны в атрибутах
+    async_view и sync_view, по ним их сравнивает bench_async_reads.
+    """
+    async_sync_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            return await async_view(request, *args, **kwargs)
+        return await async_sync_view(request, *args, **kwargs)
+    view.csrf_exempt = True
+    view.async_view = async_view
+    view.sync_view = sync_view
+    return view
+
+
+async_urlpatterns = [
+    path('recipes/', read_async(
+        async_views.recipe_list,
+        RecipeViewSet.as_view({'get': 'list', 'post': 'create'})
+    )),
+    path('recipes/<int:pk>/', read_async(
+        async_views.recipe_detail,
+        RecipeViewSet.as_view({'get': 'retrieve', 'put': 'update',
+                               'patch': 'partial_update',
+                               'delete': 'destroy'})
+    )),
+    path('users/subscriptions/', read_async(
+        async_views.subscriptions,
+        UserViewSet.as_view({'get': 'subscriptions'},
+                            **UserViewSet.subscriptions.kwargs)
+    )),
+    path('ingredients/', read_async(
+        async_views.ingredient_list,
+        IngredientViewSet.as_view({'get': 'list'})
+    )),
+    path('tags/', read_async(
+        async_views.tag_list,
+        TagViewSet.as_view({'get': 'list'})
+    )),
+    path('tags/<int:pk>/', read_async(
+        async_views.tag_detail,
+        TagViewSet.as_view({'get': 'retrieve'})
+    )),
+]
+
 urlpatterns = [
     path('', include(router_v1.urls)),
     path('auth/token/login/', create_token),
     path('auth/token/logout/', detele_token),
+    path('_metrics/', metrics),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
@@ -1,28 +1,36 @@
-import io
-
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Value
 from django.shortcuts import get_object_or_404
-from django.utils.encoding import smart_str
 from djoser.serializers import SetPasswordSerializer
+from recipes import ingredient_index, timeline
 from recipes.models import (Favourite, Follow, Ingredient, Recipe,
-                            RecipeFavourite, RecipeShoppingCart, ShoppingCart,
-                            Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.signals import update_counter
 from rest_framework import mixins, status, viewsets
 from rest_framework.authtoken.models import Token
-from rest_framework.decorators import action, api_view
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import (action, api_view, permission_classes,
+                                       renderer_classes)
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from users.models import User
 
+from .caching import VersionedCacheMixin, recipe_fragment_key, recipe_fragments
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import SubscriptionPagination
+from .metrics import registry
+from .pagination import (CursorOptInMixin, FeedPagination,
+                         RecipeCursorPagination, SubscriptionCursorPagination,
+                         SubscriptionPagination)
 from .permissions import AuthorOrReadOnly
-from .serializers import (FollowSerializer, IngridientGetSerializer,
-                          RecipeSerializer, RecipesGetSerializer,
+from .renderers import CSVRenderer, PlainTextRenderer
+from .serializers import (AUTHOR_FIELDS, FollowSerializer,
+                          IngridientGetSerializer, RecipeSerializer,
+                          RecipesGetSerializer, RecipesLimitSerializer,
                           SubscriptionsSerializer, TagGetSerializer,
                           TokenCreateSerializer, UserGetSerializer,
-                          UserSerializer)
+                          UserSerializer, with_viewer_fields)
+from .shopping_list import ITERATOR_CHUNK_SIZE, shopping_list_response
 
 
 class GetRetrieveViewSet(
@@ -40,31 +48,66 @@ class CreateListRetrieveViewSet(
     pass
 
 
-def add_subscription(author, follower, follow_instance):
+def insert_ignoring_conflict(obj):
+    """
+    Сохраняет obj через INSERT ... ON CONFLICT DO NOTHING и возвращает,
+    была ли вставлена строка. Сигналы post_save не отправляются.
+    """
+    rowcounts = []
+
+    def record_rowcount(execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        rowcounts.append(context['cursor'].rowcount)
+        return result
+
+    with connection.execute_wrapper(record_rowcount):
+        type(obj).objects.bulk_create([obj], ignore_conflicts=True)
+    return rowcounts == [1]
+
+
+def get_recipes_limit(request):
+    """Параметр recipes_limit; не целое число - ошибка 400."""
+    params = RecipesLimitSerializer(data=request.query_params)
+    params.is_valid(raise_exception=True)
+    return params.validated_data['recipes_limit']
+
+
+def add_subscription(author, follower, recipes_limit):
     """
     Создает экземпляр модели Follow с атрибутами author и follower.
+    Повторную подписку, в том числе из одновременных запросов,
+    отклоняет уникальное ограничение (follower, author). В ответе -
+    не более recipes_limit последних рецептов автора.
     """
     if author == follower:
         return Response(
             'Подписка на себя невозможна.',
             status=status.HTTP_400_BAD_REQUEST
         )
-    if follow_instance.exists():
+    with transaction.atomic():
+        follow_obj = Follow(author=author, follower=follower)
+        created = insert_ignoring_conflict(follow_obj)
+        if created:
+            update_counter(Follow, follow_obj, 1)
+            timeline.follow(author, follower)
+    if not created:
         return Response(
             f'Вы уже подписаны на автора с username {author}.',
             status=status.HTTP_400_BAD_REQUEST
         )
-    follow_obj = Follow.objects.create(author=author,
-                                       follower=follower)
-    follow_obj.save()
+    author.limited_recipes = Recipe.objects.latest_per_author(
+        [author.id], recipes_limit
+    )[author.id]
     serializer = FollowSerializer(follow_obj)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-def destroy_subscription(author, follow_instance):
+def destroy_subscription(author, follower, follow_instance):
     """Удаляет экземпрял модели Follow."""
     if follow_instance.exists():
-        follow_instance.delete()
+        with transaction.atomic():
+            follow_instance.delete()
+            timeline.unfollow(author, follower)
         message = f'Вы отписались от пользователя {author}'
         return Response(
             message,
@@ -96,6 +139,37 @@ class UserViewSet(CreateListRetrieveViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        users = User.objects.all()
+        user = self.request.user
+        if user.is_anonymous:
+            return users.annotate(is_subscribed=Value(False))
+        return users.annotate(is_subscribed=Exists(
+            Follow.objects.filter(author=OuterRef('pk'), follower=user)
+        ))
+
+    def attach_recipes(self, users):
+        """
+        Добавляет пользователям атрибут limited_recipes - не более
+        recipes_limit последних рецептов каждого.
+        """
+        recipes = Recipe.objects.latest_per_author(
+            [user.id for user in users], get_recipes_limit(self.request)
+        )
+        for user in users:
+            user.limited_recipes = recipes[user.id]
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.attach_recipes(page)
+        return page
+
+    def get_object(self):
+        user = super().get_object()
+        self.attach_recipes([user])
+        return user
+
     @action(
         detail=False,
         methods=['GET'],
@@ -104,7 +178,8 @@ class UserViewSet(CreateListRetrieveViewSet):
     )
     def get_own_information(self, request):
         """Профиль пользователя."""
-        serializer = UserGetSerializer(request.user,
+        # Пользователь из кэша токенов содержит только id и is_active.
+        serializer = UserGetSerializer(User.objects.get(id=request.user.id),
                                        context={'request': request})
         return Response(serializer.data,
                         status=status.HTTP_200_OK)
@@ -121,9 +196,9 @@ class UserViewSet(CreateListRetrieveViewSet):
             data=request.data
         )
         serializer.is_valid(raise_exception=True)
-        user = User.objects.get(username=request.user)
+        user = User.objects.get(id=request.user.id)
         user.set_password(serializer.validated_data.get('new_password'))
-        user.save()
+        user.save(update_fields=['password'])
         return Response(data='Пароль успешно изменен',
                         status=status.HTTP_204_NO_CONTENT)
 
@@ -135,15 +210,15 @@ class UserViewSet(CreateListRetrieveViewSet):
     def subscribe(self, request, pk):
         """Создание подписки на пользователя."""
         author = get_object_or_404(User, id=self.kwargs['pk'])
-        follower, follow_instance = get_follow_objcs(request, author)
-        return add_subscription(author, follower, follow_instance)
+        return add_subscription(author, request.user,
+                                get_recipes_limit(request))
 
     @subscribe.mapping.delete
     def del_subscribe(self, request, pk):
         """Удаляет подписку на пользователя."""
         author = get_object_or_404(User, id=self.kwargs['pk'])
-        _, follow_instance = get_follow_objcs(request, author)
-        return destroy_subscription(author, follow_instance)
+        follower, follow_instance = get_follow_objcs(request, author)
+        return destroy_subscription(author, follower, follow_instance)
 
     @action(
         detail=False,
@@ -151,77 +226,169 @@ class UserViewSet(CreateListRetrieveViewSet):
         permission_classes=[IsAuthenticated]
     )
     def subscriptions(self, request):
-        """Просмотр личных подписок."""
-        authors = User.objects.filter(following__follower=request.user)
-        context = {"request": request}
-        paginator = SubscriptionPagination()
+        """
+        Просмотр личных подписок.
+        С параметром cursor - keyset-пагинация по времени подписки.
+        """
+        authors = User.objects.filter(
+            following__follower=request.user
+        ).annotate(is_subscribed=Value(True),
+                   follow_id=F('following__id'))
+        paginator = (SubscriptionCursorPagination()
+                     if 'cursor' in request.query_params
+                     else SubscriptionPagination())
         page = paginator.paginate_queryset(authors, request)
-        serializer = SubscriptionsSerializer(page, context=context, many=True)
+        self.attach_recipes(page)
+        serializer = SubscriptionsSerializer(page,
+                                             context={'request': request},
+                                             many=True)
         return paginator.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    """Создание рецепта, просмотр списка или отдельного рецепта."""
+class RecipeViewSet(CursorOptInMixin, viewsets.ModelViewSet):
+    """
+    Создание рецепта, просмотр списка или отдельного рецепта.
+    С параметром cursor список отдается с keyset-пагинацией.
+    """
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = [AuthorOrReadOnly]
     filterset_class = RecipeFilter
+    cursor_pagination_class = RecipeCursorPagination
+
+    BULK_MAX_RECIPES = 100
 
-    def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+    def get_queryset(self):
+        user = self.request.user
+        return (Recipe.objects
+                .with_related(user)
+                .with_user_flags(user))
 
-    def add_obj(self, request, model, through_model):
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Рецепт: общая для всех пользователей часть берется из
+        recipe_fragments, флаги пользователя и автор - одним запросом.
+        """
+        pk = self.kwargs['pk']
+        try:
+            viewer = Recipe.objects.filter(pk=pk).viewer_fields(
+                request.user, AUTHOR_FIELDS
+            ).first()
+        except ValueError:
+            viewer = None
+        if viewer is None:
+            raise NotFound()
+        fragment = recipe_fragments.get_or_build(
+            recipe_fragment_key(request, pk),
+            lambda: self.build_fragment(pk)
+        )
+        return Response(with_viewer_fields(fragment, viewer))
+
+    def build_fragment(self, pk):
+        recipe = (Recipe.objects.with_related()
+                  .with_user_flags(None)
+                  .filter(pk=pk).first())
+        if recipe is None:
+            raise NotFound()
+        return dict(self.get_serializer(recipe).data)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe = serializer.save(author=request.user)
+        serializer = self.get_serializer(self.get_queryset().get(id=recipe.id))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=['POST'],
+        permission_classes=[IsAuthenticated]
+    )
+    def bulk(self, request):
         """
-        Создание экземпляра Favorite или ShoppinCart.
+        Создание нескольких рецептов одним запросом.
+        Если хотя бы один рецепт не прошел валидацию, ни один
+        не создается, а ошибки возвращаются списком по позициям.
+        """
+        serializer = self.get_serializer(data=request.data, many=True,
+                                         max_length=self.BULK_MAX_RECIPES)
+        serializer.is_valid(raise_exception=True)
+        ids = [recipe.id for recipe in serializer.save(author=request.user)]
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([recipes[pk] for pk in ids],
+                                         many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        permission_classes=[IsAuthenticated]
+    )
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь,
+        сначала новые. Всегда с keyset-пагинацией: следующая страница
+        запрашивается по ссылке next.
+        """
+        paginator = FeedPagination()
+        page = paginator.paginate_queryset(self.get_queryset(), request)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        cart_users = ShoppingCart.objects.filter(
+            recipe=instance
+        ).values_list('user_id', flat=True)
+        ShoppingListItem.objects.add_recipe(cart_users, instance.id,
+                                            factor=-1)
+        instance.delete()
+
+    def add_obj(self, request, model):
+        """
+        Добавление рецепта в избранное или корзину.
         Атрибуты:
         request - объект запроса;
-        model - экземпляр модели Favorite или ShoppingCart
-                в зависимости от view-функции;
-        through_model - промежуточная модель RecipeFavourite или
-                        RecipeShoppingCart в зависимости от view-функции.
+        model - модель Favourite или ShoppingCart
+                в зависимости от view-функции.
+        Повторное добавление, в том числе из одновременных запросов,
+        отклоняет уникальное ограничение (user, recipe); счетчик и
+        список покупок меняются, только если строка вставлена.
         """
         recipe = get_object_or_404(Recipe, id=self.kwargs['pk'])
-
-        if model.objects.filter(user=request.user,
-                                recipes=recipe).exists():
+        with transaction.atomic():
+            obj = model(user=request.user, recipe=recipe)
+            created = insert_ignoring_conflict(obj)
+            if created:
+                update_counter(model, obj, 1)
+                if model is ShoppingCart:
+                    ShoppingListItem.objects.add_recipe([request.user.id],
+                                                        recipe.id)
+        if not created:
             return Response(
                 {'error': 'Данный рецепт уже добавлен.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        model_instance = model.objects.create(user=request.user)
-        model_instance.recipes.add(recipe)
-        model_instance.save()
-
-        instance_data = (
-            {'shopping_cart': model_instance} if model is ShoppingCart
-            else {'favourite': model_instance}
-        )
-        if through_model.objects.filter(
-            recipe=recipe,
-            **instance_data
-        ).exists():
-            return Response(
-                RecipesGetSerializer(recipe).data,
-                status=status.HTTP_201_CREATED
-            )
-
         return Response(
-            {'error': 'Рецепт не удалось добавить.'},
-            status=status.HTTP_400_BAD_REQUEST
+            RecipesGetSerializer(recipe).data,
+            status=status.HTTP_201_CREATED
         )
 
     def del_obj(self, request, model):
-        """Удаляет экземляр модели Favorite или ShoppinCart."""
+        """Удаляет рецепт из избранного или корзины."""
         recipe = get_object_or_404(Recipe, id=self.kwargs['pk'])
-        model_instance = model.objects.filter(user=request.user,
-                                              recipes=recipe)
         model_dependent_words = (
             ['корзины', 'корзине'] if model is ShoppingCart else
             ['избранного', 'избранном']
         )
-        if model_instance.exists():
-            model_instance.delete()
+        with transaction.atomic():
+            _, deleted = model.objects.filter(user=request.user,
+                                              recipe=recipe).delete()
+            deleted = deleted.get(model._meta.label, 0)
+            if deleted and model is ShoppingCart:
+                ShoppingListItem.objects.add_recipe([request.user.id],
+                                                    recipe.id, factor=-1)
+        if deleted:
             return Response(
                 {
                     'message': (
@@ -243,7 +410,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def favorite(self, request, pk=None):
         """Добавление рецепта в избранное."""
-        return self.add_obj(request, Favourite, RecipeFavourite)
+        return self.add_obj(request, Favourite)
 
     @favorite.mapping.delete
     def del_favorite(self, request, pk=None):
@@ -257,7 +424,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def shopping_cart(self, request, pk=None):
         """Добавление рецепта в корзину."""
-        return self.add_obj(request, ShoppingCart, RecipeShoppingCart)
+        return self.add_obj(request, ShoppingCart)
 
     @shopping_cart.mapping.delete
     def del_from_shopping_cart(self, request, pk=None):
@@ -268,38 +435,30 @@ class RecipeViewSet(viewsets.ModelViewSet):
         detail=False,
         methods=['GET'],
         permission_classes=[IsAuthenticated],
+        renderer_classes=[PlainTextRenderer, CSVRenderer, JSONRenderer],
         url_path='download_shopping_cart',
         url_name='download_shopping_cart'
     )
     def download_shopping_cart(self, request):
-        """Выгрузка списка ингредиентов из добавленных в корзину рецептов."""
-        recipes_query = Recipe.objects.filter(
-            shoppingcart__user=self.request.user
-        ).all()
+        """
+        Выгрузка списка ингредиентов из добавленных в корзину рецептов.
+        Формат файла задается параметром format: txt, csv или json.
+        """
         ingredients_query = (
-            recipes_query.values(
-                "ingredient_recipe__ingredient__name",
-                "ingredient_recipe__ingredient__units",
+            ShoppingListItem.objects
+            .filter(user=self.request.user)
+            .values(
+                'amount',
+                name=F('ingredient__name'),
+                measurement_unit=F('ingredient__units'),
             )
-            .annotate(amount=Sum("ingredient_recipe__amount"))
-            .order_by()
+            .order_by('ingredient__name')
         )
-        text = "\n".join(
-            [
-                f"{item['ingredient_recipe__ingredient__name']}: "
-                f"({item['ingredient_recipe__ingredient__units']})"
-                f" - {item['amount']}, "
-                for item in ingredients_query
-            ]
+        return shopping_list_response(
+            request,
+            ingredients_query.iterator(chunk_size=ITERATOR_CHUNK_SIZE),
+            request.accepted_renderer.format
         )
-        buffer = io.BytesIO()
-        buffer.write(text.encode())
-        response = HttpResponse(buffer.getvalue(), content_type="text/plain")
-        filename = 'shopping_cart.txt'
-        response['Content-Disposition'] = (
-            f'attachment; filename={smart_str(filename)}'
-        )
-        return response
 
     @action(
         detail=True,
@@ -310,28 +469,53 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Создание подписки на пользователя по id рецепта."""
         recipe = get_object_or_404(Recipe, id=self.kwargs['pk'])
         author = recipe.author
-        follower, follow_instance = get_follow_objcs(request, author)
-        return add_subscription(author, follower, follow_instance)
+        return add_subscription(author, request.user,
+                                get_recipes_limit(request))
 
     @subscribe.mapping.delete
     def del_subscribe(self, request, pk):
         """Удаление подписки на пользователя по id рецепта."""
         recipe = get_object_or_404(Recipe, id=self.kwargs['pk'])
         author = recipe.author
-        _, follow_instance = get_follow_objcs(request, author)
-        return destroy_subscription(author, follow_instance)
+        follower, follow_instance = get_follow_objcs(request, author)
+        return destroy_subscription(author, follower, follow_instance)
 
 
-class IngredientViewSet(GetRetrieveViewSet):
+class IngredientViewSet(VersionedCacheMixin, GetRetrieveViewSet):
     """Получение списка ингредиентов или отдельного ингредиента."""
+    # Справочные данные не зависят от пользователя,
+    # поэтому токен не проверяется и запрос не обращается к БД.
+    authentication_classes = []
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngridientGetSerializer
     pagination_class = None
     filterset_class = IngredientFilter
 
-
-class TagViewSet(GetRetrieveViewSet):
+    def list(self, request, *args, **kwargs):
+        """
+        Поиск по началу и по вхождению в название ингредиента
+        выполняется по индексу в памяти, без обращения к БД.
+        Параметр limit ограничивает число результатов.
+        """
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            if not limit.isdigit() or int(limit) < 1:
+                return Response(
+                    {'limit': 'Укажите целое положительное число.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            limit = int(limit)
+        return Response(ingredient_index.search(name, limit))
+
+
+class TagViewSet(VersionedCacheMixin, GetRetrieveViewSet):
     """Получение списка тегов или отдельного тега."""
+    authentication_classes = []
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagGetSerializer
     pagination_class = None
@@ -381,3 +565,11 @@ def detele_token(request):
             data=response,
             status=status.HTTP_401_UNAUTHORIZED
         )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@renderer_classes([PlainTextRenderer])
+def metrics(request):
+    """Метрики запросов процесса в текстовом формате Prometheus."""
+    return Response(registry.render())
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -99,6 +100,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHE_BACKEND = (
+    os.getenv('CACHE_BACKEND')
+    or 'django.core.cache.backends.locmem.LocMemCache'
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Cached responses, recipe fragments and the ingredient index are
+# invalidated by version counters in the cache, which reach the other
+# processes only through a shared backend (memcached, Redis). With a
+# per-process backend they are not cached.
+
+SHARED_CACHE = CACHE_BACKEND not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -141,6 +167,70 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Recipe image variants, (width, height); images are cropped to fill them.
+# Rendered off the request thread by a pool of this many threads,
+# 0 renders them synchronously.
+
+RECIPE_IMAGE_VARIANTS = {
+    'list': (480, 320),
+    'detail': (1200, 800),
+}
+RECIPE_IMAGE_VARIANT_WORKERS = int(
+    os.getenv('RECIPE_IMAGE_VARIANT_WORKERS', 2)
+)
+
+# Maximum decoded size of a base64 recipe image, in bytes, and maximum
+# size of a POST /api/recipes/bulk/ body with the images of all its
+# recipes. The request body limit leaves room for both.
+
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', 5 * 1024 * 1024)
+)
+RECIPE_BULK_MAX_SIZE = int(
+    os.getenv('RECIPE_BULK_MAX_SIZE', 32 * 1024 * 1024)
+)
+DATA_UPLOAD_MAX_MEMORY_SIZE = max(
+    RECIPE_IMAGE_MAX_SIZE * 4 // 3 + 1024 * 1024, RECIPE_BULK_MAX_SIZE
+)
+
+# Without a shared cache the ingredient search index of each process is
+# rebuilt in the background once it is older than this many seconds.
+
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 60))
+
+# Token authentication cache: entry lifetime in seconds, size of the
+# per-process LRU and whether entries are kept in the Django cache
+# instead, so that revoked tokens are dropped in all processes. Without
+# a shared cache a revoked token stays valid in the other processes for
+# up to TOKEN_CACHE_TIMEOUT seconds.
+
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 60))
+TOKEN_CACHE_MAX_SIZE = int(os.getenv('TOKEN_CACHE_MAX_SIZE', 10000))
+TOKEN_CACHE_SHARED = os.getenv(
+    'TOKEN_CACHE_SHARED', str(SHARED_CACHE)
+) == 'True'
+
+# Serve GET requests of recipes, subscriptions, ingredients and tags with
+# the async views of api/async_views.py; meant for an ASGI server.
+
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
+# Their database work runs in a pool of this many threads, each with its
+# own connection; it bounds the concurrent queries of a process.
+
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 20))
+
+# Request time percentiles in /api/_metrics/ are computed over this many
+# latest requests of each route.
+
+REQUEST_METRICS_WINDOW = int(os.getenv('REQUEST_METRICS_WINDOW', 1000))
+
+# New recipes of authors with fewer followers are copied into the
+# timelines of the followers; the feed reads recipes of more popular
+# authors from the recipe table.
+
+FEED_FANOUT_THRESHOLD = int(os.getenv('FEED_FANOUT_THRESHOLD', 1000))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -150,7 +240,7 @@ AUTH_USER_MODEL = 'users.User'
 # Authentication
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
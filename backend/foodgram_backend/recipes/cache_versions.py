@@ -0,0 +1,48 @@
+"""
+Version counters for cached data, stored in the Django cache.
+
+A counter starts from the current time in nanoseconds, so a counter
+that was evicted from the cache never comes back with an old value.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def _keys(namespace):
+    return f'version:{namespace}', f'version:{namespace}:modified'
+
+
+def get_version(namespace):
+    """Returns (version, last modified unix timestamp) for the namespace."""
+    version_key, modified_key = _keys(namespace)
+    values = cache.get_many([version_key, modified_key])
+    if version_key not in values or modified_key not in values:
+        return bump_version(namespace)
+    return values[version_key], values[modified_key]
+
+
+def get_versions(*namespaces):
+    """Returns the versions of the namespaces with one cache read."""
+    keys = [_keys(namespace)[0] for namespace in namespaces]
+    values = cache.get_many(keys)
+    return [
+        values[key] if key in values else bump_version(namespace)[0]
+        for namespace, key in zip(namespaces, keys)
+    ]
+
+
+def bump_version(namespace):
+    """Increments the version; called whenever the cached data changes."""
+    version_key, modified_key = _keys(namespace)
+    if cache.add(version_key, time.time_ns(), timeout=None):
+        version = cache.get(version_key)
+    else:
+        try:
+            version = cache.incr(version_key)
+        except ValueError:
+            version = time.time_ns()
+            cache.set(version_key, version, timeout=None)
+    modified = int(time.time())
+    cache.set(modified_key, modified, timeout=None)
+    return version, modified
@@ -0,0 +1,233 @@
+"""
+Loading the ingredient and tag catalogue from CSV or JSON files.
+
+Rows are read as a stream and compared with the database in batches;
+new and changed rows are upserted on the natural key (name and units of
+an ingredient, slug of a tag) with conflict-aware inserts, so loading
+is idempotent and never deletes rows that recipes refer to. On
+PostgreSQL every batch is copied into a temporary table and merged with
+INSERT ... ON CONFLICT.
+"""
+import csv
+import json
+import re
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from recipes import ingredient_index
+from recipes.cache_versions import bump_version
+from recipes.models import Ingredient, Tag
+from recipes.pg_copy import copy_rows
+
+BATCH_SIZE = 1000
+DATA_DIR = Path(settings.BASE_DIR, 'ingredients_tags_data')
+JSON_CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+
+# name: (model, natural key, loaded fields, default file)
+CATALOGUES = {
+    'ingredients': (Ingredient, ('name', 'units'), ('name', 'units'),
+                    'ingredients.csv'),
+    'tags': (Tag, ('slug',), ('name', 'hex_code', 'slug'), 'tags.csv'),
+}
+# Column names of the API format.
+ALIASES = {
+    'measurement_unit': 'units',
+    'color': 'hex_code',
+}
+
+
+class CatalogueError(Exception):
+    """Unreadable file or invalid row."""
+
+
+def read_json_array(file):
+    """Yields the items of a top-level JSON array without loading it."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+    # "[" before the array, "," after an item, "item" before an item.
+    expected = '['
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        char = buffer[position:position + 1]
+        if not char:
+            if eof:
+                raise CatalogueError('Unexpected end of the JSON array.')
+        elif char == ']' and expected != '[':
+            return
+        elif expected != 'item':
+            if char != expected:
+                raise CatalogueError(f'"{expected}" expected at {position}.')
+            expected = 'item'
+            position += 1
+            continue
+        else:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                # The item may continue in the next chunk.
+                if eof:
+                    raise CatalogueError(f'Invalid JSON: {error}') from error
+            else:
+                expected = ','
+                yield item
+                continue
+        chunk = file.read(JSON_CHUNK_SIZE)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+
+
+def read_rows(path):
+    """Yields the rows of a .csv or .json file as dicts."""
+    path = Path(path)
+    if path.suffix not in ('.csv', '.json'):
+        raise CatalogueError(f'{path}: only .csv and .json are supported.')
+    try:
+        with open(path, encoding='utf-8', newline='') as file:
+            if path.suffix == '.csv':
+                yield from csv.DictReader(file)
+            else:
+                yield from read_json_array(file)
+    except (OSError, UnicodeDecodeError, csv.Error) as error:
+        raise CatalogueError(f'{path}: {error}') from error
+
+
+def clean_row(model, fields, row, number):
+    """The row with the loaded fields only, validated by the model."""
+    if not isinstance(row, dict):
+        raise CatalogueError(f'Row {number}: an object is expected.')
+    row = {ALIASES.get(column, column): value
+           for column, value in row.items()}
+    values = {}
+    for name in fields:
+        value = row.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+        try:
+            values[name] = model._meta.get_field(name).clean(value, None)
+        except ValidationError as error:
+            raise CatalogueError(
+                f'Row {number}, {name}: {" ".join(error.messages)}'
+            ) from error
+    return values
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def diff(model, key, fields, rows):
+    """
+    Splits the batch into new, changed and unchanged rows.
+    A later duplicate of a key in the batch replaces the earlier one.
+    """
+    rows = {tuple(row[name] for name in key): row for row in rows}
+    # Filtered by the first key field only: a query with an OR of every
+    # key would exceed the expression depth limit of SQLite.
+    candidates = model.objects.filter(**{
+        f'{key[0]}__in': {values[0] for values in rows}
+    })
+    existing = {
+        tuple(row[name] for name in key): row
+        for row in candidates.values(*fields)
+    }
+    new, changed, unchanged = [], [], 0
+    for values, row in rows.items():
+        current = existing.get(values)
+        if current is None:
+            new.append(row)
+        elif current != row:
+            changed.append((current, row))
+        else:
+            unchanged += 1
+    return new, changed, unchanged
+
+
+def upsert(model, key, fields, rows, use_copy):
+    update_fields = [name for name in fields if name not in key]
+    if use_copy:
+        copy_upsert(model, key, fields, update_fields, rows)
+    elif update_fields:
+        model.objects.bulk_create(
+            [model(**row) for row in rows], update_conflicts=True,
+            unique_fields=key, update_fields=update_fields
+        )
+    else:
+        model.objects.bulk_create([model(**row) for row in rows],
+                                  ignore_conflicts=True)
+
+
+def copy_upsert(model, key, fields, update_fields, rows):
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    staging = f'load_{model._meta.db_table}'
+    column_names = [model._meta.get_field(name).column for name in fields]
+    columns = ', '.join(map(quote, column_names))
+    if update_fields:
+        action = 'UPDATE SET ' + ', '.join(
+            f'{column} = EXCLUDED.{column}'
+            for column in (quote(model._meta.get_field(name).column)
+                           for name in update_fields)
+        )
+    else:
+        action = 'NOTHING'
+    with connection.cursor() as cursor:
+        # Dropped at the end of the transaction of load().
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS {quote(staging)} '
+            f'ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        cursor.execute(f'TRUNCATE {quote(staging)}')
+    copy_rows(staging, column_names,
+              ([row[name] for name in fields] for row in rows))
+    conflict = ', '.join(quote(model._meta.get_field(name).column)
+                         for name in key)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} '
+            f'FROM {quote(staging)} ON CONFLICT ({conflict}) DO {action}'
+        )
+
+
+def load(name, path=None, batch_size=BATCH_SIZE, dry_run=False,
+         use_copy=None, report=None):
+    """
+    Upserts the catalogue from the file, by default the one in
+    ingredients_tags_data, in one transaction. With dry_run only
+    reports the differences. report receives a line per new or changed
+    row. Returns a Counter of new, changed and unchanged rows.
+    """
+    model, key, fields, default_file = CATALOGUES[name]
+    if use_copy is None:
+        use_copy = connection.vendor == 'postgresql'
+    report = report or (lambda line: None)
+    source = read_rows(path or DATA_DIR / default_file)
+    rows = (clean_row(model, fields, row, number)
+            for number, row in enumerate(source, start=1))
+    counts = Counter(new=0, changed=0, unchanged=0)
+    with transaction.atomic():
+        for batch in batches(rows, batch_size):
+            new, changed, unchanged = diff(model, key, fields, batch)
+            for row in new:
+                report(f'+ {name}: {row}')
+            for current, row in changed:
+                report(f'~ {name}: {current} -> {row}')
+            counts.update(new=len(new), changed=len(changed),
+                          unchanged=unchanged)
+            if not dry_run and (new or changed):
+                upsert(model, key, fields,
+                       new + [row for _, row in changed], use_copy)
+    if not dry_run and (counts['new'] or counts['changed']):
+        if model is Ingredient:
+            ingredient_index.invalidate()
+        bump_version(name)
+    return counts
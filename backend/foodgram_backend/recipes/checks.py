@@ -0,0 +1,70 @@
+"""
+System checks of the database objects created by raw SQL.
+
+The full-text search column, trigger and index of migration 0012 are not
+part of the migration state, so a later migration that remakes the
+recipe table (SQLite does this for most column changes) drops them
+silently. The check runs with `manage.py check --database default` and
+before `manage.py migrate`.
+"""
+from django.core.checks import Error, Tags, register
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+
+SEARCH_MIGRATION = ('recipes', '0012_recipe_search')
+
+# vendor: (query of the object names, expected names)
+SEARCH_OBJECTS = {
+    'postgresql': (
+        """
+        SELECT tgname FROM pg_trigger
+        WHERE tgrelid = 'recipes_recipe'::regclass
+        UNION SELECT attname FROM pg_attribute
+        WHERE attrelid = 'recipes_recipe'::regclass AND NOT attisdropped
+        UNION SELECT indexname FROM pg_indexes
+        WHERE tablename = 'recipes_recipe'
+        """,
+        {'recipes_recipe_search_vector', 'search_vector',
+         'recipe_search_idx'},
+    ),
+    'sqlite': (
+        """
+        SELECT name FROM sqlite_master
+        WHERE tbl_name IN ('recipes_recipe', 'recipes_recipe_search')
+        """,
+        {'recipes_recipe_search', 'recipes_recipe_search_insert',
+         'recipes_recipe_search_delete', 'recipes_recipe_search_update'},
+    ),
+}
+
+
+def missing_search_objects(connection):
+    """Names of the search objects missing in the database."""
+    if connection.vendor not in SEARCH_OBJECTS:
+        return set()
+    if SEARCH_MIGRATION not in MigrationRecorder(
+        connection
+    ).applied_migrations():
+        return set()
+    query, expected = SEARCH_OBJECTS[connection.vendor]
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        return expected - {name for name, in cursor.fetchall()}
+
+
+@register(Tags.database)
+def check_search_objects(app_configs, databases=None, **kwargs):
+    errors = []
+    for alias in databases or []:
+        missing = missing_search_objects(connections[alias])
+        if missing:
+            errors.append(Error(
+                f'Full-text search objects are missing in the {alias!r} '
+                f'database: {", ".join(sorted(missing))}.',
+                hint='Run the statements of '
+                     'recipes/migrations/0012_recipe_search.py that create '
+                     'them, or apply a migration that does so with '
+                     '`migrate --skip-checks`.',
+                id='recipes.E001',
+            ))
+    return errors
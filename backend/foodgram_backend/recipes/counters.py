@@ -0,0 +1,77 @@
+"""
+Denormalized counters.
+
+The signal handlers keep every counter current with an F() update that
+runs in the transaction of the write; reconcile() recomputes a counter
+from its relation table to repair drift left by bulk operations. The
+recipe serializers set ingredients_count themselves, as they write the
+ingredients of a recipe in bulk.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import Favourite, Follow, IngredientRecipe, Recipe
+from users.models import User
+
+# (model, counter field, counted model, its foreign key to model)
+COUNTERS = {
+    'favourites': (Recipe, 'favourites_count', Favourite, 'recipe'),
+    'recipes': (User, 'recipes_count', Recipe, 'author'),
+    'followers': (User, 'followers_count', Follow, 'author'),
+    'ingredients': (Recipe, 'ingredients_count', IngredientRecipe, 'recipe'),
+}
+
+
+def increment(model, pk, field, delta=1):
+    """Adds delta to the counter with UPDATE ... SET field = field + delta."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def increment_many(model, field, pks):
+    """Increments the counter once for every occurrence of a pk."""
+    for pk, delta in Counter(pks).items():
+        increment(model, pk, field, delta)
+
+
+def actual_count(counted_model, foreign_key):
+    counts = (
+        counted_model.objects.filter(**{foreign_key: OuterRef('pk')})
+        .order_by()
+        .values(foreign_key)
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def reconcile(name, batch_size=1000, after_pk=None):
+    """
+    Recomputes the counter in batches of primary keys, one transaction
+    per batch, for the rows after after_pk or all rows.
+    Returns the number of repaired rows.
+    """
+    model, field, counted_model, foreign_key = COUNTERS[name]
+    repaired = 0
+    last_pk = after_pk
+    while True:
+        batch = model.objects.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return repaired
+        last_pk = pks[-1]
+        with transaction.atomic():
+            drifted = list(
+                model.objects.filter(pk__in=pks)
+                .annotate(actual=actual_count(counted_model, foreign_key))
+                .exclude(**{field: F('actual')})
+                .values_list('pk', flat=True)
+            )
+            if drifted:
+                model.objects.filter(pk__in=drifted).update(
+                    **{field: actual_count(counted_model, foreign_key)}
+                )
+        repaired += len(drifted)
@@ -0,0 +1,170 @@
+"""
+Fixed-size list and detail variants of recipe images, in JPEG and WebP.
+
+Variants are rendered once per uploaded image by a local thread pool,
+after the transaction that saved the recipe commits, and their storage
+names are kept in Recipe.image_variants together with the name of the
+source image. The files of the previous image are deleted once the new
+ones are stored, and all of them when the recipe is deleted. With
+RECIPE_IMAGE_VARIANT_WORKERS = 0 they are rendered synchronously.
+Failed tasks are logged; shutdown() waits for the queued ones.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+from recipes.cache_versions import bump_version
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.RECIPE_IMAGE_VARIANT_WORKERS,
+                    thread_name_prefix='image-variants'
+                )
+    return _executor
+
+
+def shutdown(wait=True):
+    """Stops the pool; a later task starts a new one."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def report_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error('Image variants task failed.',
+                     exc_info=future.exception())
+
+
+def run_in_worker(func, *args):
+    try:
+        func(*args)
+    finally:
+        connections.close_all()
+
+
+def submit(func, *args):
+    """Runs func(*args) in the pool, or right away without workers."""
+    if not settings.RECIPE_IMAGE_VARIANT_WORKERS:
+        func(*args)
+        return
+    future = get_executor().submit(run_in_worker, func, *args)
+    future.add_done_callback(report_failure)
+
+
+def is_current(recipe):
+    """True if the variants were rendered from the current image."""
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') == recipe.image.name
+    )
+
+
+def variant_name(source, variant, extension):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f'recipes/images/variants/{stem}_{variant}.{extension}'
+
+
+def flatten(image):
+    """Converts to RGB, putting transparent images on a white background."""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(source, storage):
+    """Saves every variant of the source image, returns their names."""
+    files = {}
+    with storage.open(source) as file, Image.open(file) as image:
+        image = flatten(image)
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+            resized = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+            files[variant] = {}
+            for extension, (image_format, options) in FORMATS.items():
+                buffer = BytesIO()
+                resized.save(buffer, image_format, **options)
+                files[variant][extension] = storage.save(
+                    variant_name(source, variant, extension),
+                    ContentFile(buffer.getvalue())
+                )
+    return files
+
+
+def file_names(variants):
+    return [name for files in variants.get('files', {}).values()
+            for name in files.values()]
+
+
+def delete_files(names):
+    storage = Recipe._meta.get_field('image').storage
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.exception('Image variant %s was not deleted.', name)
+
+
+def generate(pk, source):
+    """
+    Renders the variants and stores them on the recipe in place of the
+    previous ones, unless its image was replaced in the meantime.
+    """
+    try:
+        files = render(source, Recipe._meta.get_field('image').storage)
+        with transaction.atomic():
+            previous = Recipe.objects.select_for_update().filter(
+                pk=pk, image=source
+            ).values_list('image_variants', flat=True).first()
+            if previous is not None:
+                Recipe.objects.filter(pk=pk).update(
+                    image_variants={'source': source, 'files': files}
+                )
+        if previous is None:
+            delete_files(file_names({'files': files}))
+        else:
+            bump_version(f'recipe:{pk}')
+            delete_files(file_names(previous))
+    except Exception:
+        logger.exception('Image variants of recipe %s failed.', pk)
+
+
+def schedule(recipe):
+    """Queues the variants of a new image once the transaction commits."""
+    if not recipe.image or is_current(recipe):
+        return
+    pk, source = recipe.pk, recipe.image.name
+    transaction.on_commit(lambda: submit(generate, pk, source))
+
+
+def discard(recipe):
+    """Deletes the variant files of a deleted recipe after the commit."""
+    names = file_names(recipe.image_variants)
+    if names:
+        transaction.on_commit(lambda: submit(delete_files, names))
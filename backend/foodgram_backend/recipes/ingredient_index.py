@@ -0,0 +1,191 @@
+"""
+In-memory index for ingredient autocomplete.
+
+Each process builds the index once, on its first search, and then
+answers searches from memory only. It is rebuilt by a background
+thread, while searches keep using the old index, when it is stale:
+after the Ingredient signals or load_data mark it so, when the shared
+'ingredients' cache version differs from the one it was built for
+(SHARED_CACHE) or, without a shared cache, when it is older than
+INGREDIENT_INDEX_TTL seconds.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+from recipes.cache_versions import get_version
+from recipes.models import Ingredient
+
+logger = logging.getLogger(__name__)
+
+
+def fold(value):
+    """Normalizes a string for case-insensitive comparison."""
+    return value.casefold().replace('ё', 'е').strip()
+
+
+class IngredientIndex:
+    """Ranked prefix and substring search over ingredient names."""
+
+    NGRAM = 3
+
+    def __init__(self, rows):
+        entries = sorted(
+            (fold(name), pk, name, units) for pk, name, units in rows
+        )
+        self.keys = [entry[0] for entry in entries]
+        self.items = [
+            {'id': pk, 'name': name, 'measurement_unit': units}
+            for _, pk, name, units in entries
+        ]
+        self.ngrams = {}
+        for position, key in enumerate(self.keys):
+            for size in range(1, self.NGRAM + 1):
+                for start in range(len(key) - size + 1):
+                    self.ngrams.setdefault(
+                        key[start:start + size], set()
+                    ).add(position)
+
+    def _prefix_matches(self, query):
+        position = bisect_left(self.keys, query)
+        while (position < len(self.keys)
+               and self.keys[position].startswith(query)):
+            yield position
+            position += 1
+
+    def _infix_candidates(self, query):
+        if not query:
+            return range(len(self.keys))
+        size = min(len(query), self.NGRAM)
+        postings = sorted(
+            (self.ngrams.get(query[start:start + size], set())
+             for start in range(len(query) - size + 1)),
+            key=len
+        )
+        return set.intersection(*postings)
+
+    def _infix_matches(self, query):
+        matches = []
+        for position in self._infix_candidates(query):
+            offset = self.keys[position].find(query)
+            if offset > 0:
+                matches.append((offset, position))
+        matches.sort()
+        for _, position in matches:
+            yield position
+
+    def search(self, query, limit=None):
+        """
+        Returns ingredients whose name contains the query:
+        prefix matches first, then matches inside the name.
+        """
+        query = fold(query)
+        results = []
+        for matches in (self._prefix_matches(query),
+                        self._infix_matches(query)):
+            for position in matches:
+                if limit is not None and len(results) >= limit:
+                    return results
+                results.append(self.items[position])
+        return results
+
+
+_index = None
+_version = None
+_built_at = 0.0
+_stale = False
+_thread = None
+_lock = threading.Lock()
+
+
+def current_version():
+    if settings.SHARED_CACHE:
+        return get_version('ingredients')[0]
+    return None
+
+
+def rebuild():
+    """Builds the index from the database and swaps it in."""
+    global _index, _version, _built_at, _stale
+    with _lock:
+        _stale = False
+    # The version is read before the rows: a change committed meanwhile
+    # bumps it again and the index is rebuilt once more.
+    version = current_version()
+    index = IngredientIndex(
+        Ingredient.objects.values_list('id', 'name', 'units')
+    )
+    with _lock:
+        _index, _version, _built_at = index, version, time.monotonic()
+    return index
+
+
+def rebuild_in_thread():
+    try:
+        rebuild()
+    except Exception:
+        logger.exception('Ingredient index rebuild failed.')
+    finally:
+        connections.close_all()
+
+
+def is_stale():
+    if _stale:
+        return True
+    if settings.SHARED_CACHE:
+        return current_version() != _version
+    return time.monotonic() - _built_at > settings.INGREDIENT_INDEX_TTL
+
+
+def schedule():
+    """Starts a background rebuild unless one is running."""
+    global _thread
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=rebuild_in_thread,
+                                   name='ingredient-index', daemon=True)
+        _thread.start()
+
+
+def wait(timeout=None):
+    """Waits for the background rebuild, if any."""
+    thread = _thread
+    if thread is not None:
+        thread.join(timeout)
+
+
+def get_index():
+    index = _index
+    if index is None:
+        # The first search of the process.
+        with _lock:
+            index = _index
+        if index is None:
+            return rebuild()
+    if is_stale():
+        schedule()
+    return index
+
+
+def invalidate():
+    """Marks the index stale; called after the ingredients change."""
+    global _stale
+    with _lock:
+        _stale = True
+
+
+def clear():
+    """Drops the index; the next search builds it again."""
+    global _index, _version, _stale
+    wait()
+    with _lock:
+        _index = _version = None
+        _stale = False
+
+
+def search(query, limit=None):
+    return get_index().search(query, limit)
@@ -0,0 +1,90 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from recipes.models import (Favourite, Follow, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, TagRecipe)
+from users.models import User
+
+SEQUENTIAL_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX)'),
+}
+
+
+class Command(BaseCommand):
+    """EXPLAIN for the hot API queries."""
+    help = ('Print query plans of the hot API queries and flag '
+            'sequential scans.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--disable-seqscan',
+            action='store_true',
+            help=('PostgreSQL only: plan with enable_seqscan = off, so that '
+                  'small tables do not hide missing indexes.')
+        )
+        parser.add_argument(
+            '--fail-on-seq-scan',
+            action='store_true',
+            help='Exit with an error if any plan has a sequential scan.'
+        )
+
+    def hot_queries(self):
+        user = User.objects.order_by('id').first() or User(id=1)
+        recipe = Recipe.objects.order_by('id').first() or Recipe(id=1)
+        return {
+            'recipe list': (
+                Recipe.objects.with_user_flags(user)[:6]
+            ),
+            'recipe list (cursor)': (
+                Recipe.objects.filter(publication_date__lt=timezone.now())
+                .order_by('-publication_date', '-id')[:7]
+            ),
+            'recipe list by tag': (
+                Recipe.objects.filter(tags__slug='breakfast')[:6]
+            ),
+            'recipe ingredients': (
+                IngredientRecipe.objects.filter(recipe_id__in=[recipe.id])
+                .select_related('ingredient')
+            ),
+            'recipe tags': TagRecipe.objects.filter(recipe_id__in=[recipe.id]),
+            'is favorited': Favourite.objects.filter(user=user,
+                                                     recipe=recipe),
+            'is in shopping cart': ShoppingCart.objects.filter(
+                user=user, recipe=recipe
+            ),
+            'is subscribed': Follow.objects.filter(author=recipe.author_id,
+                                                   follower=user),
+            'subscriptions': User.objects.filter(following__follower=user),
+            'author recipes': Recipe.objects.filter(author_id__in=[user.id]),
+            'shopping list': ShoppingListItem.objects.filter(user=user),
+        }
+
+    def handle(self, *args, **options):
+        pattern = SEQUENTIAL_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            self.stderr.write(
+                f'Sequential scans are not detected on {connection.vendor}.'
+            )
+        flagged = []
+        with transaction.atomic():
+            if (options['disable_seqscan']
+                    and connection.vendor == 'postgresql'):
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in self.hot_queries().items():
+                plan = queryset.explain()
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(plan)
+                tables = pattern.findall(plan) if pattern else []
+                if tables:
+                    flagged.append(name)
+                    self.stdout.write(self.style.WARNING(
+                        f'Sequential scan on: {", ".join(sorted(set(tables)))}'
+                    ))
+        if flagged and options['fail_on_seq_scan']:
+            raise CommandError(
+                f'Sequential scans in: {", ".join(flagged)}.'
+            )
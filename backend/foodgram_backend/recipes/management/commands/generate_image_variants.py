@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from recipes import image_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Rendering missing image variants of existing recipes."""
+    help = ('Render the list and detail variants of recipe images that '
+            'have none or were rendered from a replaced image.')
+
+    def handle(self, *args, **options):
+        rendered = 0
+        recipes = Recipe.objects.exclude(image='').exclude(image=None).only(
+            'id', 'image', 'image_variants'
+        )
+        for recipe in recipes.iterator():
+            if not image_variants.is_current(recipe):
+                image_variants.generate(recipe.id, recipe.image.name)
+                rendered += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Image variants rendered for {rendered} recipes.'
+        ))
@@ -1,36 +1,65 @@
-import csv
-from pathlib import Path
-
-from django.conf import settings
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient, Tag
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from recipes import catalogue
+from recipes.catalogue import BATCH_SIZE, CATALOGUES, CatalogueError
 
 
 class Command(BaseCommand):
-    """Loading data to ingredient model."""
-    help = 'Load csv files to ingredient model.'
+    """Loading the ingredient and tag catalogue."""
+    help = ('Upsert ingredients and tags from CSV or JSON files. Existing '
+            'rows are matched by name and units or by slug and are never '
+            'deleted, so the command can be run again safely.')
+
+    def add_arguments(self, parser):
+        for name, (_, _, _, default_file) in CATALOGUES.items():
+            parser.add_argument(
+                f'--{name}',
+                metavar='PATH',
+                help=(f'.csv or .json file; ingredients_tags_data/'
+                      f'{default_file} by default.')
+            )
+        parser.add_argument(
+            '--only',
+            choices=list(CATALOGUES),
+            help='Load only this catalogue.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Rows compared and written at a time.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Print the new and changed rows without writing them.'
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Use bulk inserts instead of COPY on PostgreSQL.'
+        )
 
-    def handle(self, *args, **kwargs):
-        path_to_data = f'{settings.BASE_DIR}/ingredients_tags_data'
-        model_and_filename = [
-            {
-                'model': Ingredient,
-                'filename': 'ingredients.csv'
-            },
-            {
-                'model': Tag,
-                'filename': 'tags.csv'
-            },
-        ]
-        print(path_to_data)
-        for el in model_and_filename:
-            csv_file = Path(path_to_data, el['filename'])
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        use_copy = (connection.vendor == 'postgresql'
+                    and not options['no_copy'])
+        names = [options['only']] if options['only'] else CATALOGUES
+        for name in names:
             try:
-                with open(f'{csv_file}', 'r') as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    el['model'].objects.all().delete()
-                    objs = [el['model'](**row) for row in reader]
-                    el['model'].objects.bulk_create(objs)
-                    print(f'Unpacking of {el["filename"]} was successful!')
-            except Exception as er:
-                raise ('An error occurred while unpacking the file', er)
+                counts = catalogue.load(
+                    name, options[name], options['batch_size'],
+                    dry_run=options['dry_run'], use_copy=use_copy,
+                    report=(self.stdout.write if options['dry_run']
+                            else None)
+                )
+            except CatalogueError as error:
+                raise CommandError(
+                    f'Loading {name} failed, nothing was changed: {error}'
+                ) from error
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {counts["new"]} new, {counts["changed"]} changed, '
+                f'{counts["unchanged"]} unchanged'
+                f'{" (dry run)" if options["dry_run"] else ""}.'
+            ))
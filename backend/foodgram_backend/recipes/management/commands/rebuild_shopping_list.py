@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.models import ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Rebuilding or verifying the shopping list aggregate."""
+    help = ('Rebuild the per-user shopping list aggregate from shopping '
+            'carts or, with --verify, only report the differences.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare the aggregate with the carts without changing it.'
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (row['user_id'], row['ingredient_id']): row['total']
+            for row in ShoppingListItem.objects.from_carts().iterator()
+        }
+        if options['verify']:
+            self.verify(expected)
+        else:
+            self.rebuild(expected)
+
+    def verify(self, expected):
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in
+            ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        mismatches = 0
+        for key in expected.keys() | actual.keys():
+            if expected.get(key) != actual.get(key):
+                mismatches += 1
+                self.stdout.write(
+                    f'user {key[0]}, ingredient {key[1]}: '
+                    f'expected {expected.get(key)}, got {actual.get(key)}'
+                )
+        if mismatches:
+            raise CommandError(
+                f'Shopping list aggregate has {mismatches} mismatched rows.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Shopping list aggregate is consistent ({len(actual)} rows).'
+        ))
+
+    @transaction.atomic
+    def rebuild(self, expected):
+        ShoppingListItem.objects.all().delete()
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id,
+                              ingredient_id=ingredient_id,
+                              amount=total)
+             for (user_id, ingredient_id), total in expected.items()),
+            batch_size=BATCH_SIZE
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Shopping list aggregate rebuilt ({len(expected)} rows).'
+        ))
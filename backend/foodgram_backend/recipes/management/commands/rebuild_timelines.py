@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes import timeline
+
+
+class Command(BaseCommand):
+    """Rebuilding the timelines of the followed-authors feed."""
+    help = ('Rebuild the per-user feed timelines from follows and recipes, '
+            'e.g. after changing FEED_FANOUT_THRESHOLD or editing follows '
+            'in the admin.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            entries = timeline.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Timelines rebuilt ({entries} entries).'
+        ))
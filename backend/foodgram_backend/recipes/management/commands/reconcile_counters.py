@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.counters import COUNTERS, reconcile
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Repairing drift of the denormalized counters."""
+    help = ('Recompute the favourites, recipes, followers and '
+            'ingredients counters from the relation tables and fix the '
+            'rows that drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'counters',
+            nargs='*',
+            help=(f'Counters to reconcile: {", ".join(COUNTERS)}; '
+                  'all of them by default.')
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Rows recomputed per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['counters']) - COUNTERS.keys()
+        if unknown:
+            raise CommandError(
+                f'Unknown counters: {", ".join(sorted(unknown))}.'
+            )
+        for name in options['counters'] or COUNTERS:
+            repaired = reconcile(name, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {repaired} rows repaired.'
+            ))
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from recipes.synthetic import BATCH_SIZE, Seeder
+
+
+class Command(BaseCommand):
+    """Generating a production-sized synthetic dataset."""
+    help = ('Generate synthetic users, recipes with ingredients of the '
+            'real catalogue, follows, favourites and shopping carts with '
+            'power-law popularity. Rows are loaded in batches with COPY on '
+            'PostgreSQL and bulk_create elsewhere.')
+
+    def add_arguments(self, parser):
+        for name, default, help_text in (
+            ('users', 100000, 'Users to create.'),
+            ('recipes', 1000000, 'Recipes to create.'),
+            ('follows', 20, 'Authors followed by a user on average.'),
+            ('favourites', 30, 'Favourite recipes of a user on average.'),
+            ('carts', 3, 'Recipes in the shopping cart of every user.'),
+            ('days', 365, 'Publication dates span this many last days.'),
+            ('seed', 0, 'Random seed; equal seeds give equal datasets.'),
+            ('batch-size', BATCH_SIZE, 'Rows per COPY or bulk_create.'),
+        ):
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=help_text)
+        parser.add_argument(
+            '--exponent',
+            type=float,
+            default=0.8,
+            help=('Zipf exponent of author, recipe and ingredient '
+                  'popularity; 0 picks uniformly.')
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Use bulk_create on PostgreSQL too.'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['recipes'] < 1:
+            raise CommandError('At least 2 users and 1 recipe are needed.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        use_copy = (connection.vendor == 'postgresql'
+                    and not options['no_copy'])
+        start = time.monotonic()
+
+        def log(message):
+            self.stdout.write(f'[{time.monotonic() - start:7.1f}s] '
+                              f'{message}')
+
+        seeder = Seeder(
+            options['users'], options['recipes'], options['follows'],
+            options['favourites'], options['carts'], seed=options['seed'],
+            exponent=options['exponent'], days=options['days'],
+            use_copy=use_copy, batch_size=options['batch_size'], log=log
+        )
+        seeder.run()
+        self.stdout.write(self.style.SUCCESS(
+            f'Dataset generated in {time.monotonic() - start:.1f}s '
+            f'({"COPY" if use_copy else "bulk_create"}).'
+        ))
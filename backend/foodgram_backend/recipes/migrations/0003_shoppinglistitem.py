@@ -0,0 +1,70 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_list(apps, schema_editor, user_ids=None):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    RecipeShoppingCart = apps.get_model('recipes', 'RecipeShoppingCart')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    # Every add created a cart of its own, so a user may have a recipe
+    # in several carts; it is counted once, by its first cart row.
+    first_rows = (
+        RecipeShoppingCart.objects
+        .values('shopping_cart__user', 'recipe')
+        .annotate(first_id=models.Min('id'))
+        .values('first_id')
+    )
+    # One filter() call: the conditions must share the cart join.
+    conditions = {
+        'recipe__recipeshoppingcart__id__in': first_rows,
+        'recipe__recipeshoppingcart__shopping_cart__user__isnull': False,
+    }
+    if user_ids is not None:
+        conditions[
+            'recipe__recipeshoppingcart__shopping_cart__user__in'
+        ] = user_ids
+    totals = (
+        IngredientRecipe.objects
+        .filter(**conditions)
+        .values('ingredient_id',
+                user_id=models.F(
+                    'recipe__recipeshoppingcart__shopping_cart__user'
+                ))
+        .annotate(total=models.Sum('amount'))
+        .order_by()
+    )
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=row['user_id'],
+                          ingredient_id=row['ingredient_id'],
+                          amount=row['total'])
+         for row in totals.iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(default=0)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='recipes.ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunPython(fill_shopping_list, migrations.RunPython.noop),
+    ]
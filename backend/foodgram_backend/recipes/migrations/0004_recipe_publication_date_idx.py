@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-publication_date', '-id'], name='recipe_publication_date_idx'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:39
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+shopping_list = import_module('recipes.migrations.0003_shoppinglistitem')
+
+UNIQUE_FIELDS = {
+    'Follow': ('follower', 'author'),
+    'IngredientRecipe': ('recipe', 'ingredient'),
+    'TagRecipe': ('tag', 'recipe'),
+    'RecipeFavourite': ('favourite', 'recipe'),
+    'RecipeShoppingCart': ('shopping_cart', 'recipe'),
+}
+
+
+def deduplicate(apps, schema_editor):
+    """Keeps the oldest row of every duplicate group before the constraints."""
+    removed = {}
+    for model_name, fields in UNIQUE_FIELDS.items():
+        model = apps.get_model('recipes', model_name)
+        duplicates = (
+            model.objects.values(*fields)
+            .annotate(keep_id=models.Min('id'), rows=models.Count('id'))
+            .filter(rows__gt=1)
+            .order_by()
+        )
+        removed[model_name] = []
+        for group in duplicates.iterator():
+            keep_id = group.pop('keep_id')
+            group.pop('rows')
+            model.objects.filter(**group).exclude(id=keep_id).delete()
+            removed[model_name].append(group)
+    apps.get_model('recipes', 'Follow').objects.filter(
+        author=models.F('follower')
+    ).delete()
+    rebuild_shopping_lists(apps, removed)
+
+
+def rebuild_shopping_lists(apps, removed):
+    """
+    The shopping list aggregate of 0003 counted the duplicate ingredient
+    and cart rows: recomputes it for the owners of the affected carts.
+    """
+    carts = apps.get_model('recipes', 'ShoppingCart').objects.filter(
+        models.Q(id__in={group['shopping_cart']
+                         for group in removed['RecipeShoppingCart']})
+        | models.Q(recipes__in={group['recipe']
+                                for group in removed['IngredientRecipe']})
+    )
+    user_ids = set(carts.filter(user__isnull=False).values_list(
+        'user_id', flat=True
+    ))
+    if user_ids:
+        apps.get_model('recipes', 'ShoppingListItem').objects.filter(
+            user_id__in=user_ids
+        ).delete()
+        shopping_list.fill_shopping_list(apps, None, user_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_publication_date_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('follower', 'author'), name='unique_follow'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.CheckConstraint(check=models.Q(('author', models.F('follower')), _negated=True), name='prevent_self_follow'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_ingredient_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipefavourite',
+            constraint=models.UniqueConstraint(fields=('favourite', 'recipe'), name='unique_recipe_favourite'),
+        ),
+        migrations.AddConstraint(
+            model_name='recipeshoppingcart',
+            constraint=models.UniqueConstraint(fields=('shopping_cart', 'recipe'), name='unique_recipe_shopping_cart'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagrecipe',
+            constraint=models.UniqueConstraint(fields=('tag', 'recipe'), name='unique_tag_recipe'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+THROUGH_MODELS = {
+    'Favourite': ('RecipeFavourite', 'favourite'),
+    'ShoppingCart': ('RecipeShoppingCart', 'shopping_cart'),
+}
+
+
+def flatten(apps, schema_editor):
+    """Moves every (user, recipe) pair into its own row, once."""
+    for model_name, (through_name, container) in THROUGH_MODELS.items():
+        model = apps.get_model('recipes', model_name)
+        through = apps.get_model('recipes', through_name)
+        pairs = (
+            through.objects
+            .values_list(f'{container}__user_id', 'recipe_id')
+            .distinct()
+            .order_by()
+        )
+        batch = []
+        for user_id, recipe_id in pairs.iterator(chunk_size=BATCH_SIZE):
+            batch.append(model(user_id=user_id, recipe_id=recipe_id))
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_create(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+        model.objects.filter(recipe__isnull=True).delete()
+
+
+def unflatten(apps, schema_editor):
+    for model_name, (through_name, container) in THROUGH_MODELS.items():
+        model = apps.get_model('recipes', model_name)
+        through = apps.get_model('recipes', through_name)
+        through.objects.bulk_create(
+            (through(**{f'{container}_id': pk, 'recipe_id': recipe_id})
+             for pk, recipe_id in model.objects.values_list('id',
+                                                            'recipe_id')),
+            batch_size=BATCH_SIZE
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_relation_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favourite',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe'),
+        ),
+        migrations.RunPython(flatten, unflatten),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_flatten_favourite_shopping_cart'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='favourite',
+            name='recipes',
+        ),
+        migrations.RemoveField(
+            model_name='shoppingcart',
+            name='recipes',
+        ),
+        migrations.DeleteModel(
+            name='RecipeFavourite',
+        ),
+        migrations.DeleteModel(
+            name='RecipeShoppingCart',
+        ),
+        migrations.AlterField(
+            model_name='favourite',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe'),
+        ),
+        migrations.AlterField(
+            model_name='shoppingcart',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='favourite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favourite'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_cart'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:44
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    (('recipes', 'Recipe'), 'favourites_count',
+     ('recipes', 'Favourite'), 'recipe'),
+    (('users', 'User'), 'recipes_count', ('recipes', 'Recipe'), 'author'),
+    (('users', 'User'), 'followers_count', ('recipes', 'Follow'), 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model, field, counted_model, foreign_key in COUNTERS:
+        counts = (
+            apps.get_model(*counted_model).objects
+            .filter(**{foreign_key: models.OuterRef('pk')})
+            .order_by()
+            .values(foreign_key)
+            .annotate(count=models.Count('pk'))
+            .values('count')
+        )
+        apps.get_model(*model).objects.update(
+            **{field: Coalesce(models.Subquery(counts), 0)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_counters'),
+        ('recipes', '0007_remove_recipe_favourite_shopping_cart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favourites_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:05
+
+from django.db import migrations, models
+
+# Models referring to an ingredient, with the field that must stay unique
+# together with it and the field summed up when two rows collide.
+REFERENCES = (
+    ('IngredientRecipe', 'recipe', 'amount'),
+    ('ShoppingListItem', 'user', 'amount'),
+)
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Keeps the oldest of the ingredients with equal name and units and
+    moves the references of the others to it before the constraint.
+    """
+    ingredient = apps.get_model('recipes', 'Ingredient')
+    duplicates = (
+        ingredient.objects.values('name', 'units')
+        .annotate(keep_id=models.Min('id'), rows=models.Count('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for group in duplicates.iterator():
+        merged = ingredient.objects.filter(
+            name=group['name'], units=group['units']
+        ).exclude(id=group['keep_id'])
+        for model_name, owner, amount in REFERENCES:
+            model = apps.get_model('recipes', model_name)
+            for row in model.objects.filter(ingredient__in=merged):
+                kept = model.objects.filter(
+                    ingredient_id=group['keep_id'],
+                    **{f'{owner}_id': getattr(row, f'{owner}_id')}
+                ).first()
+                if kept is None:
+                    row.ingredient_id = group['keep_id']
+                    row.save(update_fields=['ingredient'])
+                else:
+                    setattr(kept, amount,
+                            getattr(kept, amount) + getattr(row, amount))
+                    kept.save(update_fields=[amount])
+                    row.delete()
+        merged.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:12
+
+from django.db import migrations
+
+# The search vector is not a model field: it is written by the trigger
+# only, so inserts and updates through the ORM, bulk_create and COPY
+# keep it current row by row.
+POSTGRESQL_FORWARD = [
+    'ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector',
+    """
+    CREATE FUNCTION recipes_recipe_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_search_vector
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector()
+    """,
+    # Fires the trigger for the existing rows.
+    'UPDATE recipes_recipe SET name = name',
+    'CREATE INDEX recipe_search_idx ON recipes_recipe '
+    'USING gin (search_vector)',
+]
+POSTGRESQL_BACKWARD = [
+    'DROP TRIGGER recipes_recipe_search_vector ON recipes_recipe',
+    'DROP FUNCTION recipes_recipe_search_vector()',
+    'ALTER TABLE recipes_recipe DROP COLUMN search_vector',
+]
+# An external content FTS5 table: it stores the index only and reads
+# name and text from recipes_recipe.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE recipes_recipe_search USING fts5(
+        name, text, content='recipes_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_search_insert
+    AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_search (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_search_delete
+    AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_search
+            (recipes_recipe_search, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_search_update
+    AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_search
+            (recipes_recipe_search, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_search (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    "INSERT INTO recipes_recipe_search (recipes_recipe_search) "
+    "VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER recipes_recipe_search_insert',
+    'DROP TRIGGER recipes_recipe_search_delete',
+    'DROP TRIGGER recipes_recipe_search_update',
+    'DROP TABLE recipes_recipe_search',
+]
+STATEMENTS = {
+    'postgresql': (POSTGRESQL_FORWARD, POSTGRESQL_BACKWARD),
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+}
+
+
+def run(direction):
+    def execute(apps, schema_editor):
+        # Other databases search with a substring match.
+        statements = STATEMENTS.get(schema_editor.connection.vendor)
+        if statements is not None:
+            for sql in statements[direction]:
+                schema_editor.execute(sql, params=None)
+    return execute
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(0), run(1)),
+    ]
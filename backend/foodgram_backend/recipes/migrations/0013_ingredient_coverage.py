@@ -0,0 +1,65 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:12
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+search = import_module('recipes.migrations.0012_recipe_search')
+
+
+def fill_ingredients_count(apps, schema_editor):
+    counts = (
+        apps.get_model('recipes', 'IngredientRecipe').objects
+        .filter(recipe=models.OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(count=models.Count('pk'))
+        .values('count')
+    )
+    apps.get_model('recipes', 'Recipe').objects.update(
+        ingredients_count=Coalesce(models.Subquery(counts), 0)
+    )
+
+
+def restore_search_triggers(apps, schema_editor):
+    """
+    SQLite adds and removes a column by copying recipes_recipe into a new
+    table, which drops the triggers of the search index; the index itself stays
+    valid, as the ids are kept.
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in search.SQLITE_FORWARD:
+            if 'CREATE TRIGGER' in sql:
+                # Newer SQLite versions drop a column in place.
+                schema_editor.execute(
+                    sql.replace('CREATE TRIGGER',
+                                'CREATE TRIGGER IF NOT EXISTS'),
+                    params=None
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_search'),
+    ]
+
+    operations = [
+        # Restores the triggers after the column is removed on unapplying.
+        migrations.RunPython(migrations.RunPython.noop,
+                             restore_search_triggers),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(restore_search_triggers,
+                             migrations.RunPython.noop),
+        migrations.RunPython(fill_ingredients_count,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredientrecipe',
+            index=models.Index(fields=['ingredient', 'recipe'], name='ingredient_recipes_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def fill_timelines(apps, schema_editor):
+    """The timelines of the existing follows, as recipes.timeline.rebuild."""
+    recipe = apps.get_model('recipes', 'Recipe')
+    entry = apps.get_model('recipes', 'TimelineEntry')
+    rows = recipe.objects.filter(
+        author__followers_count__lt=settings.FEED_FANOUT_THRESHOLD,
+        author__following__isnull=False
+    ).values_list(
+        'author__following__follower_id', 'id', 'publication_date'
+    ).order_by()
+    batch = []
+    for user_id, recipe_id, publication_date in rows.iterator(
+        chunk_size=BATCH_SIZE
+    ):
+        batch.append(entry(user_id=user_id, recipe_id=recipe_id,
+                           publication_date=publication_date))
+        if len(batch) == BATCH_SIZE:
+            entry.objects.bulk_create(batch)
+            batch = []
+    entry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0013_ingredient_coverage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('publication_date', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-publication_date', '-id'], name='recipe_author_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-publication_date', '-recipe'], name='timeline_user_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,182 @@
-from django.db import models
+import re
+from itertools import chain
+
+from django.db import connection, connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 from users.models import User
 
+# Full-text search over name and text: a tsvector column with a GIN index
+# on PostgreSQL and an FTS5 table on SQLite, both kept current by triggers
+# of migration 0012.
+SEARCH_CONFIG = 'russian'
+SEARCH_TABLE = 'recipes_recipe_search'
+SEARCH_WORD = re.compile(r'\w+')
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Query helpers for recipe list and detail endpoints."""
+
+    def with_related(self, user=None):
+        """
+        Loads author, tags and ingredients with a fixed number of queries.
+        The author is annotated with is_subscribed for the given user.
+        """
+        authors = User.objects.all()
+        if user is not None and user.is_authenticated:
+            authors = authors.annotate(is_subscribed=models.Exists(
+                Follow.objects.filter(author=models.OuterRef('pk'),
+                                      follower=user)
+            ))
+        else:
+            authors = authors.annotate(is_subscribed=models.Value(False))
+        return self.prefetch_related(
+            models.Prefetch('author', queryset=authors),
+            'tags',
+            models.Prefetch(
+                'ingredient_recipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """Annotates is_favorited and is_in_shopping_cart for the user."""
+        if user is None or not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Favourite.objects.filter(recipe=models.OuterRef('pk'),
+                                         user=user)
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(recipe=models.OuterRef('pk'),
+                                            user=user)
+            ),
+        )
+
+    def viewer_fields(self, user, author_fields):
+        """
+        Values of the recipe detail that differ between users or change
+        without saving the recipe: the user flags, author_is_subscribed
+        and the author fields as author__<field>.
+        """
+        if user is not None and user.is_authenticated:
+            is_subscribed = models.Exists(
+                Follow.objects.filter(author=models.OuterRef('author_id'),
+                                      follower=user)
+            )
+        else:
+            is_subscribed = models.Value(False)
+        return self.with_user_flags(user).annotate(
+            author_is_subscribed=is_subscribed
+        ).values(
+            'is_favorited', 'is_in_shopping_cart', 'author_is_subscribed',
+            *(f'author__{field}' for field in author_fields)
+        )
+
+    def search(self, query):
+        """
+        Recipes matching every word of the query, annotated with
+        search_rank and ordered by it, best first. Name matches outweigh
+        text matches. PostgreSQL stems Russian words and understands the
+        web search syntax ("quotes", or, -word); SQLite matches word
+        prefixes; other databases fall back to a substring match.
+        """
+        words = SEARCH_WORD.findall(query)
+        if not words:
+            return self.none()
+        database = connections[self.db]
+        table = database.ops.quote_name(self.model._meta.db_table)
+        if database.vendor == 'postgresql':
+            tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+            condition = RawSQL(f'{table}.search_vector @@ {tsquery}',
+                               (query,), output_field=models.BooleanField())
+            rank = RawSQL(f'ts_rank({table}.search_vector, {tsquery})',
+                          (query,), output_field=models.FloatField())
+        elif database.vendor == 'sqlite':
+            match = ' '.join('"{}"*'.format(word) for word in words)
+            condition = RawSQL(
+                f'{table}.id IN (SELECT rowid FROM {SEARCH_TABLE} '
+                f'WHERE {SEARCH_TABLE} MATCH %s)',
+                (match,), output_field=models.BooleanField()
+            )
+            # bm25() is lower for better matches.
+            rank = RawSQL(
+                f'(SELECT -bm25({SEARCH_TABLE}, 10.0, 1.0) '
+                f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                f'AND rowid = {table}.id)',
+                (match,), output_field=models.FloatField()
+            )
+        else:
+            condition = models.Q()
+            for word in words:
+                condition &= (models.Q(name__icontains=word)
+                              | models.Q(text__icontains=word))
+            rank = models.Case(
+                models.When(name__icontains=words[0], then=1.0),
+                default=0.0, output_field=models.FloatField()
+            )
+        return self.filter(condition).annotate(search_rank=rank).order_by(
+            '-search_rank', '-publication_date', '-id'
+        )
+
+    def by_coverage(self, ingredient_ids):
+        """
+        Recipes with at least one of the ingredients, annotated with the
+        numbers of matched and missing ingredients; recipes that can be
+        cooked from the ingredients come first, then the ones with fewer
+        missing. Only the index entries of the given ingredients are
+        read, the recipe size comes from ingredients_count.
+        """
+        return self.filter(
+            ingredient_recipe__ingredient_id__in=ingredient_ids
+        ).annotate(
+            matched_ingredients=models.Count('ingredient_recipe',
+                                             distinct=True),
+            missing_ingredients=(models.F('ingredients_count')
+                                 - models.F('matched_ingredients')),
+        ).order_by('missing_ingredients', '-matched_ingredients',
+                   '-publication_date', '-id')
+
+    def latest_per_author(self, author_ids, limit):
+        """
+        Returns {author_id: [recipes]} with at most `limit` latest recipes
+        of every author. Uses one ROW_NUMBER() query where the database
+        supports window functions and a query per author otherwise.
+        """
+        recipes = {author_id: [] for author_id in author_ids}
+        if not recipes:
+            # An empty IN () can not be compiled into the window query.
+            return recipes
+        queryset = self.filter(author_id__in=author_ids).only(
+            'id', 'author_id', 'name', 'image', 'image_variants',
+            'cooking_time', 'publication_date'
+        )
+        if connection.features.supports_over_clause:
+            ranked = queryset.annotate(recipe_rank=models.Window(
+                RowNumber(),
+                partition_by=models.F('author_id'),
+                order_by=[models.F('publication_date').desc(),
+                          models.F('id').desc()]
+            )).order_by()
+            sql, params = ranked.query.sql_with_params()
+            rows = self.model.objects.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                'WHERE recipe_rank <= %s ORDER BY recipe_rank',
+                (*params, limit)
+            )
+        else:
+            rows = chain.from_iterable(
+                queryset.filter(author_id=author_id)[:limit]
+                for author_id in author_ids
+            )
+        for recipe in rows:
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
 
 class Recipe(models.Model):
     """Creates and save recipe data."""
@@ -17,13 +193,26 @@ class Recipe(models.Model):
         null=True,
         default=None
     )
+    image_variants = models.JSONField(default=dict, blank=True,
+                                      editable=False)
     name = models.CharField(max_length=200)
     text = models.TextField()
     cooking_time = models.PositiveSmallIntegerField()
     publication_date = models.DateTimeField(auto_now_add=True)
+    favourites_count = models.IntegerField(default=0, editable=False)
+    ingredients_count = models.PositiveSmallIntegerField(default=0,
+                                                         editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-publication_date']
+        indexes = [
+            models.Index(fields=['-publication_date', '-id'],
+                         name='recipe_publication_date_idx'),
+            models.Index(fields=['author', '-publication_date', '-id'],
+                         name='recipe_author_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -34,6 +223,12 @@ class Ingredient(models.Model):
     name = models.CharField(max_length=200)
     units = models.CharField(max_length=100)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'units'],
+                                    name='unique_ingredient'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -48,6 +243,18 @@ class IngredientRecipe(models.Model):
                                on_delete=models.CASCADE)
     amount = models.PositiveSmallIntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'ingredient'],
+                                    name='unique_ingredient_recipe'),
+        ]
+        indexes = [
+            # Inverted index: the recipes of an ingredient are read
+            # from the index alone.
+            models.Index(fields=['ingredient', 'recipe'],
+                         name='ingredient_recipes_idx'),
+        ]
+
     def __str__(self):
         return f'{self.amount}'
 
@@ -69,6 +276,12 @@ class TagRecipe(models.Model):
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'recipe'],
+                                    name='unique_tag_recipe'),
+        ]
+
 
 class Follow(models.Model):
     author = models.ForeignKey(User,
@@ -78,27 +291,144 @@ class Follow(models.Model):
                                  on_delete=models.CASCADE,
                                  related_name='follower')
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'author'],
+                                    name='unique_follow'),
+            models.CheckConstraint(
+                check=~models.Q(author=models.F('follower')),
+                name='prevent_self_follow'
+            ),
+        ]
+
 
 class Favourite(models.Model):
-    recipes = models.ManyToManyField(Recipe, through='RecipeFavourite')
+    """Recipe added to the user's favourites."""
     user = models.ForeignKey(User,
                              related_name='favourites',
                              on_delete=models.CASCADE)
-
-
-class RecipeFavourite(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
-    favourite = models.ForeignKey(Favourite, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique_favourite'),
+        ]
 
 
 class ShoppingCart(models.Model):
-    recipes = models.ManyToManyField(Recipe, through='RecipeShoppingCart')
+    """Recipe added to the user's shopping cart."""
     user = models.ForeignKey(User,
                              related_name='ingredients',
                              on_delete=models.CASCADE)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique_shopping_cart'),
+        ]
 
-class RecipeShoppingCart(models.Model):
-    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
-    shopping_cart = models.ForeignKey(ShoppingCart,
-                                      on_delete=models.CASCADE)
+
+class TimelineEntry(models.Model):
+    """
+    Recipe in the feed of a follower of its author, see recipes.timeline.
+    The publication date is copied, so a feed page is read from the index.
+    """
+    user = models.ForeignKey(User,
+                             related_name='timeline',
+                             on_delete=models.CASCADE)
+    recipe = models.ForeignKey(Recipe,
+                               related_name='+',
+                               on_delete=models.CASCADE)
+    publication_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-publication_date', '-recipe'],
+                         name='timeline_user_date_idx'),
+        ]
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    """Incremental maintenance of the per-user shopping list aggregate."""
+
+    def apply_deltas(self, user_ids, deltas):
+        """
+        Adds ingredient amount deltas ({ingredient_id: delta})
+        to the shopping lists of the given users.
+        Rows whose total drops to zero are removed.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        user_ids = set(user_ids)
+        if not user_ids or not deltas:
+            return
+        with transaction.atomic():
+            self.bulk_create(
+                [ShoppingListItem(user_id=user_id,
+                                  ingredient_id=ingredient_id,
+                                  amount=0)
+                 for user_id in user_ids
+                 for ingredient_id, delta in deltas.items() if delta > 0],
+                ignore_conflicts=True
+            )
+            items = self.filter(user_id__in=user_ids,
+                                ingredient_id__in=deltas)
+            items.update(amount=models.F('amount') + models.Case(
+                *[models.When(ingredient_id=ingredient_id,
+                              then=models.Value(delta))
+                  for ingredient_id, delta in deltas.items()],
+                default=models.Value(0)
+            ))
+            items.filter(amount__lte=0).delete()
+
+    def add_recipe(self, user_ids, recipe_id, factor=1):
+        """
+        Adds the recipe ingredients to the shopping lists of the users.
+        A negative factor removes them.
+        """
+        amounts = IngredientRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+        self.apply_deltas(
+            user_ids,
+            {ingredient_id: amount * factor
+             for ingredient_id, amount in amounts}
+        )
+
+    def from_carts(self):
+        """Computes the aggregate from scratch as (user, ingredient) rows."""
+        return (
+            IngredientRecipe.objects
+            .filter(recipe__shoppingcart__user__isnull=False)
+            .values('ingredient_id',
+                    user_id=models.F('recipe__shoppingcart__user'))
+            .annotate(total=models.Sum('amount'))
+            .order_by()
+        )
+
+
+class ShoppingListItem(models.Model):
+    """Total amount of an ingredient in the user's shopping cart."""
+    user = models.ForeignKey(User,
+                             related_name='shopping_list',
+                             on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient,
+                                   related_name='shopping_list',
+                                   on_delete=models.CASCADE)
+    amount = models.IntegerField(default=0)
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='unique_shopping_list_item'),
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient}: {self.amount}'
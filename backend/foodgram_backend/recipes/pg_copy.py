@@ -0,0 +1,35 @@
+"""Writing rows with PostgreSQL COPY in the text format."""
+import io
+import json
+
+from django.db import connection
+
+
+def copy_text(value):
+    """A value as a field of the COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(table, columns, rows):
+    """COPY rows, sequences of values in the order of columns."""
+    data = io.StringIO()
+    for row in rows:
+        data.write('\t'.join(map(copy_text, row)))
+        data.write('\n')
+    data.seek(0)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {quote(table)} ({", ".join(map(quote, columns))}) '
+            'FROM STDIN',
+            data
+        )
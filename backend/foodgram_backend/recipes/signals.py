@@ -0,0 +1,75 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes import counters, image_variants, ingredient_index, timeline
+from recipes.cache_versions import bump_version
+from recipes.counters import COUNTERS
+from recipes.models import (Favourite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, Tag, TagRecipe)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    # The indexes must not be rebuilt before the change is visible:
+    # this process rebuilds it once marked stale, the others once they
+    # see the new version.
+    transaction.on_commit(ingredient_index.invalidate)
+    transaction.on_commit(lambda: bump_version('ingredients'))
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_version('tags')
+
+
+@receiver(post_save, sender=Favourite)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_save, sender=Recipe)
+def counted_created(sender, instance, created, **kwargs):
+    if created:
+        update_counter(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Favourite)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(post_delete, sender=Recipe)
+def counted_deleted(sender, instance, **kwargs):
+    update_counter(sender, instance, -1)
+
+
+def update_counter(sender, instance, delta):
+    for model, field, counted_model, foreign_key in COUNTERS.values():
+        if counted_model is sender:
+            counters.increment(model, getattr(instance, f'{foreign_key}_id'),
+                               field, delta)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    image_variants.schedule(instance)
+    if created:
+        timeline.fan_out([instance])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    image_variants.discard(instance)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    bump_recipe_version(instance.id)
+
+
+@receiver([post_save, post_delete], sender=IngredientRecipe)
+@receiver([post_save, post_delete], sender=TagRecipe)
+def recipe_relation_changed(sender, instance, **kwargs):
+    bump_recipe_version(instance.recipe_id)
+
+
+def bump_recipe_version(recipe_id):
+    # After the commit: a fragment built from the old rows until then
+    # is stored under the old version.
+    transaction.on_commit(lambda: bump_version(f'recipe:{recipe_id}'))
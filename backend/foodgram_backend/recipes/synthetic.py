@@ -0,0 +1,323 @@
+"""
+Synthetic data for benchmarks and scale tests.
+
+Seeder streams users, recipes with ingredients of the real catalogue,
+follows, favourites and shopping carts into the database in batches:
+with COPY on PostgreSQL and bulk_create elsewhere. Primary keys are
+allocated up front, so related rows are written without reading the
+parents back. Authors, ingredients and recipes are picked with Zipf
+weights and per-user follow and favourite counts are Pareto-distributed,
+so a few authors and recipes get most of the attention, as in
+production. No signals are sent, so the seeder recomputes the
+denormalized counters, the shopping list aggregate and the feed
+timelines of the new rows.
+"""
+import math
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from recipes import catalogue, counters, timeline
+from recipes.catalogue import CATALOGUES
+from recipes.models import (Favourite, Follow, Ingredient, IngredientRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            TagRecipe, TimelineEntry)
+from recipes.pg_copy import copy_rows
+from users.models import User
+
+BATCH_SIZE = 10000
+INGREDIENTS_PER_RECIPE = (3, 10)
+TAGS_PER_RECIPE = (1, 2)
+SYNTHETIC_IMAGE = 'recipes/images/synthetic.jpg'
+# Shape of the Pareto distribution of per-user counts.
+PARETO_ALPHA = 1.5
+# Multiplier coprime with the number of rows, spreads popular ranks
+# over the whole primary key range.
+SCATTER = 2654435761
+
+
+def ensure_catalogue():
+    """Loads ingredients and tags from ingredients_tags_data if missing."""
+    for name, (model, *_) in CATALOGUES.items():
+        if not model.objects.exists():
+            catalogue.load(name)
+
+
+class BulkWriter:
+    """Collects rows of a model and inserts them with bulk_create."""
+
+    def __init__(self, model):
+        self.model = model
+        self.rows = []
+        self.written = 0
+
+    def add(self, **values):
+        self.rows.append(values)
+
+    def flush(self):
+        self.insert(self.rows)
+        self.written += len(self.rows)
+        self.rows = []
+
+    def insert(self, rows):
+        if not rows:
+            return
+        self.model.objects.bulk_create(
+            [self.model(**values) for values in rows],
+            batch_size=BATCH_SIZE
+        )
+        # bulk_create gives auto_now_add fields the insertion time,
+        # the given values are written back by primary key.
+        dated = [field.name for field in self.model._meta.concrete_fields
+                 if getattr(field, 'auto_now_add', False)
+                 and field.attname in rows[0]]
+        if dated and self.model._meta.pk.attname in rows[0]:
+            self.model.objects.bulk_update(
+                [self.model(**values) for values in rows], dated,
+                batch_size=BATCH_SIZE
+            )
+
+
+class CopyWriter(BulkWriter):
+    """Inserts rows with PostgreSQL COPY."""
+
+    def insert(self, rows):
+        if not rows:
+            return
+        # The primary key is left to its sequence unless given.
+        fields = [field for field in self.model._meta.concrete_fields
+                  if not field.primary_key or field.attname in rows[0]]
+        now = timezone.now()
+        defaults = {
+            field.attname: (now if getattr(field, 'auto_now_add', False)
+                            else field.get_default())
+            for field in fields
+        }
+        copy_rows(
+            self.model._meta.db_table,
+            [field.column for field in fields],
+            ([values.get(field.attname, defaults[field.attname])
+              for field in fields] for values in rows)
+        )
+
+
+def zipf_weights(size, exponent):
+    """Cumulative weights of ranks 1..size proportional to 1 / rank^s."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+class Population:
+    """
+    Primary keys first_pk..first_pk + size - 1 picked with Zipf weights.
+    Rank r maps to a pseudo-random key, so popular rows are not all the
+    oldest ones.
+    """
+
+    def __init__(self, first_pk, size, exponent):
+        self.first_pk = first_pk
+        self.size = size
+        self.weights = zipf_weights(size, exponent)
+        self.scatter = SCATTER if math.gcd(SCATTER, size) == 1 else 1
+
+    def pick(self, rng, count, exclude=None):
+        """Up to count distinct keys, excluding exclude."""
+        count = min(count, self.size - (exclude is not None))
+        if count > self.size // 2:
+            # Rare ranks would take long to draw, so dense picks are
+            # uniform.
+            keys = range(self.first_pk, self.first_pk + self.size)
+            return set(rng.sample(
+                [pk for pk in keys if pk != exclude], count
+            ))
+        picked = set()
+        while len(picked) < count:
+            for rank in rng.choices(range(self.size), cum_weights=self.weights,
+                                    k=count - len(picked)):
+                pk = self.first_pk + rank * self.scatter % self.size
+                if pk != exclude:
+                    picked.add(pk)
+        return picked
+
+
+def next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def heavy_tailed(rng, mean, limit):
+    """Pareto-distributed integer with the given mean, at most limit."""
+    if mean <= 0:
+        return 0
+    scale = mean * (PARETO_ALPHA - 1) / PARETO_ALPHA
+    return min(int(scale * rng.paretovariate(PARETO_ALPHA)), limit)
+
+
+class Seeder:
+    """
+    Writes a synthetic dataset: `users` users and `recipes` recipes;
+    on average a user follows `follows` authors, has `favourites`
+    favourite recipes and `carts` recipes in the shopping cart.
+    """
+
+    def __init__(self, users, recipes, follows=0, favourites=0, carts=0,
+                 seed=0, exponent=0.8, days=365, use_copy=None,
+                 batch_size=BATCH_SIZE, prefix='synthetic', log=None):
+        self.users = users
+        self.recipes = recipes
+        self.follows = follows
+        self.favourites = favourites
+        self.carts = carts
+        self.rng = random.Random(seed)
+        self.exponent = exponent
+        self.days = days
+        if use_copy is None:
+            use_copy = connection.vendor == 'postgresql'
+        self.writer_class = CopyWriter if use_copy else BulkWriter
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.log = log or (lambda message: None)
+
+    def write(self, model, rows, *children):
+        """
+        Writes rows of the model in batches. A row is a dict of field
+        values or a (values, {child model: [child values]}) pair; child
+        rows are written right after the batch of their parents.
+        """
+        writers = {model: self.writer_class(model)}
+        writers.update((child, self.writer_class(child))
+                       for child in children)
+        for row in rows:
+            values, related = row if isinstance(row, tuple) else (row, {})
+            writers[model].add(**values)
+            for child, child_rows in related.items():
+                for child_values in child_rows:
+                    writers[child].add(**child_values)
+            if len(writers[model].rows) >= self.batch_size:
+                self.flush(writers)
+        self.flush(writers)
+        for writer in writers.values():
+            self.log(f'{writer.model.__name__}: {writer.written} rows')
+        return {writer.model: writer.written for writer in writers.values()}
+
+    def flush(self, writers):
+        with transaction.atomic():
+            for writer in writers.values():
+                writer.flush()
+
+    def run(self):
+        """Writes the dataset and returns {model: rows written}."""
+        ensure_catalogue()
+        self.first_user = next_pk(User)
+        self.first_recipe = next_pk(Recipe)
+        self.authors = Population(self.first_user, self.users, self.exponent)
+        ingredient_ids = list(Ingredient.objects.values_list('id',
+                                                             flat=True))
+        self.rng.shuffle(ingredient_ids)
+        self.ingredients = Population(0, len(ingredient_ids), self.exponent)
+        self.ingredient_ids = ingredient_ids
+        self.tag_ids = list(Tag.objects.values_list('id', flat=True))
+        written = self.write(User, self.user_rows())
+        written.update(self.write(Recipe, self.recipe_rows(),
+                                  IngredientRecipe, TagRecipe))
+        self.recipe_population = Population(self.first_recipe, self.recipes,
+                                            self.exponent)
+        written.update(self.write(Follow, self.follow_rows()))
+        written.update(self.write(Favourite, self.user_recipe_rows(
+            self.favourites, heavy_tailed
+        )))
+        written.update(self.write(ShoppingCart, self.user_recipe_rows(
+            self.carts, lambda rng, mean, limit: min(mean, limit)
+        )))
+        self.reset_sequences()
+        for name, (model, *_) in counters.COUNTERS.items():
+            first = self.first_recipe if model is Recipe else self.first_user
+            counters.reconcile(name, self.batch_size, after_pk=first - 1)
+        self.log('Counters recomputed')
+        written.update(self.write(ShoppingListItem, (
+            {'user_id': row['user_id'],
+             'ingredient_id': row['ingredient_id'],
+             'amount': row['total']}
+            for row in ShoppingListItem.objects.from_carts().filter(
+                user_id__gte=self.first_user
+            ).iterator(chunk_size=self.batch_size)
+        )))
+        written.update(self.write(TimelineEntry, (
+            {'user_id': user_id, 'recipe_id': recipe_id,
+             'publication_date': publication_date}
+            for user_id, recipe_id, publication_date in timeline.entries(
+                Follow.objects.filter(follower_id__gte=self.first_user)
+            ).iterator(chunk_size=self.batch_size)
+        )))
+        return written
+
+    def user_rows(self):
+        password = make_password(None)
+        for pk in range(self.first_user, self.first_user + self.users):
+            yield {
+                'id': pk, 'username': f'{self.prefix}{pk}',
+                'email': f'{self.prefix}{pk}@example.com',
+                'first_name': 'Имя', 'last_name': 'Фамилия',
+                'password': password,
+            }
+
+    def recipe_rows(self):
+        rng = self.rng
+        start = timezone.now() - timedelta(days=self.days)
+        step = timedelta(days=self.days) / max(self.recipes, 1)
+        for number in range(self.recipes):
+            pk = self.first_recipe + number
+            ingredients = self.ingredients.pick(
+                rng, rng.randint(*INGREDIENTS_PER_RECIPE)
+            )
+            values = {
+                'id': pk,
+                'author_id': self.authors.pick(rng, 1).pop(),
+                'name': f'Рецепт {pk}',
+                'text': 'Описание рецепта. ' * rng.randint(1, 20),
+                'cooking_time': rng.randint(1, 180),
+                'image': SYNTHETIC_IMAGE,
+                'image_variants': {},
+                'publication_date': start + step * number,
+                'ingredients_count': len(ingredients),
+            }
+            yield values, {
+                IngredientRecipe: [
+                    {'recipe_id': pk,
+                     'ingredient_id': self.ingredient_ids[index],
+                     'amount': rng.randint(1, 500)}
+                    for index in ingredients
+                ],
+                TagRecipe: [
+                    {'recipe_id': pk, 'tag_id': tag_id}
+                    for tag_id in rng.sample(
+                        self.tag_ids,
+                        min(rng.randint(*TAGS_PER_RECIPE), len(self.tag_ids))
+                    )
+                ],
+            }
+
+    def follow_rows(self):
+        for follower in range(self.first_user, self.first_user + self.users):
+            count = heavy_tailed(self.rng, self.follows, self.users - 1)
+            for author in self.authors.pick(self.rng, count,
+                                            exclude=follower):
+                yield {'follower_id': follower, 'author_id': author}
+
+    def user_recipe_rows(self, mean, distribution):
+        for user in range(self.first_user, self.first_user + self.users):
+            count = distribution(self.rng, mean, self.recipes)
+            for recipe in self.recipe_population.pick(self.rng, count):
+                yield {'user_id': user, 'recipe_id': recipe}
+
+    def reset_sequences(self):
+        """Moves the primary key sequences past the explicit keys."""
+        statements = connection.ops.sequence_reset_sql(no_style(),
+                                                       [User, Recipe])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
@@ -0,0 +1,154 @@
+"""
+Materialized feeds of the followed authors.
+
+A new recipe of an author with fewer than FEED_FANOUT_THRESHOLD
+followers is copied into the timeline of every follower (fan-out on
+write). Recipes of more popular authors are not copied: the feed reads
+them from the recipe table and merges them with the timeline (fan-in on
+read), so a recipe of such an author costs one insert instead of one per
+follower. Following an author copies their recipes into the timeline and
+unfollowing removes them; when an author drops below the threshold, the
+recipes published meanwhile are copied to all followers.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from recipes.models import Follow, Recipe, TimelineEntry
+from users.models import User
+
+BATCH_SIZE = 1000
+
+
+def threshold():
+    return settings.FEED_FANOUT_THRESHOLD
+
+
+def insert(rows):
+    """Inserts (user_id, recipe_id, publication_date) rows in batches."""
+    rows = iter(rows)
+    while True:
+        batch = [
+            TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                          publication_date=publication_date)
+            for user_id, recipe_id, publication_date
+            in islice(rows, BATCH_SIZE)
+        ]
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def followers_count(author_id):
+    return User.objects.values_list('followers_count',
+                                    flat=True).get(id=author_id)
+
+
+def fan_out(recipes):
+    """Copies new recipes into the timelines of the author's followers."""
+    recipes = list(recipes)
+    authors = set(User.objects.filter(
+        id__in={recipe.author_id for recipe in recipes},
+        followers_count__lt=threshold()
+    ).values_list('id', flat=True))
+    insert(
+        (follower_id, recipe.id, recipe.publication_date)
+        for recipe in recipes if recipe.author_id in authors
+        for follower_id in Follow.objects.filter(
+            author_id=recipe.author_id
+        ).values_list('follower_id', flat=True).iterator()
+    )
+
+
+def backfill(author_id, follower_ids):
+    """Copies all recipes of the author into the followers' timelines."""
+    recipes = list(Recipe.objects.filter(author_id=author_id).values_list(
+        'id', 'publication_date'
+    ))
+    insert(
+        (follower_id, recipe_id, publication_date)
+        for follower_id in follower_ids
+        for recipe_id, publication_date in recipes
+    )
+
+
+def follow(author, follower):
+    """Called after the follow is created."""
+    if followers_count(author.id) < threshold():
+        backfill(author.id, [follower.id])
+
+
+def unfollow(author, follower):
+    """Called after the follow is deleted."""
+    TimelineEntry.objects.filter(user=follower,
+                                 recipe__author=author).delete()
+    if followers_count(author.id) == threshold() - 1:
+        # The author is not popular any more: the feed stops reading
+        # the recipes of the author, which were not copied meanwhile.
+        backfill(author.id, Follow.objects.filter(
+            author=author
+        ).values_list('follower_id', flat=True).iterator())
+
+
+def entries(follows=None):
+    """
+    (user_id, recipe_id, publication_date) rows of the timelines for the
+    follows, by default all of them.
+    """
+    rows = Recipe.objects.filter(author__followers_count__lt=threshold())
+    if follows is None:
+        rows = rows.filter(author__following__isnull=False)
+    else:
+        rows = rows.filter(author__following__in=follows)
+    return rows.values_list(
+        'author__following__follower_id', 'id', 'publication_date'
+    ).order_by()
+
+
+def page(rows, key, after, reverse, limit):
+    """
+    (publication_date, key) pairs after the cursor in the feed order,
+    newest first, or before it, oldest first, with reverse.
+    """
+    lookup, prefix = ('gt', '') if reverse else ('lt', '-')
+    if after is not None:
+        date, pk = after
+        rows = rows.filter(
+            Q(**{f'publication_date__{lookup}': date})
+            | Q(publication_date=date, **{f'{key}__{lookup}': pk})
+        )
+    return list(rows.values_list('publication_date', key).order_by(
+        f'{prefix}publication_date', f'{prefix}{key}'
+    )[:limit])
+
+
+def feed(user, limit, after=None, reverse=False):
+    """
+    Ids of up to limit recipes of the user's feed after the
+    (publication_date, recipe id) cursor, see page().
+    """
+    popular = Follow.objects.filter(
+        follower=user, author__followers_count__gte=threshold()
+    ).values('author_id')
+    pages = [
+        page(TimelineEntry.objects.filter(user=user), 'recipe_id',
+             after, reverse, limit),
+        page(Recipe.objects.filter(author__in=popular), 'id',
+             after, reverse, limit),
+    ]
+    ids = []
+    # A recipe copied before its author became popular is in both.
+    for _, pk in heapq.merge(*pages, reverse=not reverse):
+        if pk not in ids:
+            ids.append(pk)
+            if len(ids) == limit:
+                break
+    return ids
+
+
+def rebuild():
+    """Rebuilds all timelines; returns the number of entries."""
+    TimelineEntry.objects.all().delete()
+    insert(entries().iterator(chunk_size=BATCH_SIZE))
+    return TimelineEntry.objects.count()
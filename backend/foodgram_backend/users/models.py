@@ -38,6 +38,8 @@ class User(AbstractUser):
         blank=True,
         default=USER,
     )
+    recipes_count = models.IntegerField(default=0, editable=False)
+    followers_count = models.IntegerField(default=0, editable=False)
 
     USERNAME_FIELD = 'username'
 